@@ -14,7 +14,9 @@ HAS_SWITCH_PAGE = hasattr(st, "switch_page")
 BRAND_HEX = "#0ea5e9"  # change to your brand color (e.g., "#8b5cf6")
 
 # ---------- Styles (compact, only what's used) ----------
-st.markdown(f"""
+# Emitted on every run: Streamlit drops elements a rerun doesn't re-emit,
+# so a once-per-session guard would strip the page styling after navigation.
+HOME_CSS = f"""
 <style>
 :root {{ --brand: {BRAND_HEX}; }}
 
@@ -49,7 +51,8 @@ st.markdown(f"""
 }}
 .section-dot {{ width:12px; height:12px; border-radius:999px; background: var(--brand); opacity:.75; }}
 </style>
-""", unsafe_allow_html=True)
+"""
+st.markdown(HOME_CSS, unsafe_allow_html=True)
 
 # ---------- Small helpers ----------
 def hero(title: str, subtitle: str):
@@ -1,13 +1,61 @@
+import base64
 import hashlib
+import types
+from functools import lru_cache
+import numpy as np
 import pandas as pd
+import streamlit as st
 import plotly.express as px
+import plotly.io as pio
+import plotly.offline as po
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 from plotly.graph_objects import Figure
 from typing import Optional, List, Tuple, Callable
 from streamlit.components.v1 import html
 
+# ---------------- JSON Engine ----------------
+# orjson is optional; when present it also speeds up st.plotly_chart,
+# which serializes through plotly.io with the default engine.
+try:
+    import orjson  # noqa: F401
+    pio.json.config.default_engine = "orjson"
+    JSON_ENGINE = "orjson"
+except ImportError:
+    JSON_ENGINE = "json"
+
+try:
+    import xxhash as _xxhash
+except ImportError:
+    _xxhash = None
+
+try:
+    import pyarrow  # noqa: F401
+    _HAS_PYARROW = True
+except ImportError:
+    _HAS_PYARROW = False
+
 # ---------------- Default Theme ----------------
 DEFAULT_THEME = ["#3b82f6", "#10b981", "#f59e0b", "#ef4444", "#8b5cf6"]
 
+# ---------------- Category Labels ----------------
+_SEX_LABELS = {
+    "m": "Male", "male": "Male", "man": "Male", "boy": "Male",
+    "f": "Female", "female": "Female", "woman": "Female", "girl": "Female",
+}
+
+def _map_uniques(s: pd.Series, fn: Callable[[str], object]) -> pd.Series:
+    """Apply fn once per distinct string value and broadcast back via factorize codes."""
+    if _HAS_PYARROW:
+        # Arrow-backed strings factorize in C; missing values get code -1,
+        # which indexes the trailing "nan" label (what astype(str) would produce).
+        codes, uniques = pd.factorize(s.astype("string[pyarrow]"))
+        mapped = np.array([fn(u) for u in uniques] + [fn("nan")], dtype=object)
+    else:
+        codes, uniques = pd.factorize(s.astype(str))
+        mapped = np.array([fn(u) for u in uniques], dtype=object)
+    return pd.Series(mapped[codes], index=s.index, name=s.name)
+
 # ==============================================================
 #                         CHART BUILDER
 # ==============================================================
@@ -15,37 +63,44 @@ DEFAULT_THEME = ["#3b82f6", "#10b981", "#f59e0b", "#ef4444", "#8b5cf6"]
 class ChartBuilder:
     def __init__(self, color_theme: Optional[List[str]] = None):
         self.color_theme = color_theme or DEFAULT_THEME
+        # Fixed sex colours (alphabetical, matching the order grouped tables come out in)
+        self._sex_cmap = {s: self.color_theme[i % len(self.color_theme)] for i, s in enumerate(("Female", "Male"))}
 
     # ---------------- Helpers ----------------
     @staticmethod
     def _normalize_sex_series(s: pd.Series) -> pd.Series:
         if s is None:
             return pd.Series([], dtype="string")
-        z = (
-            s.astype(str)
-            .str.strip()
-            .str.lower()
-            .replace({
-                "m": "male",
-                "male": "male",
-                "man": "male",
-                "boy": "male",
-                "f": "female",
-                "female": "female",
-                "woman": "female",
-                "girl": "female",
-            })
-        )
-        return z.map({"male": "Male", "female": "Female"})
+        return ChartBuilder._normalize_sex_impl(s)
 
     @staticmethod
     def _normalize_newold_series(s: pd.Series) -> pd.Series:
         if s is None:
             return pd.Series([], dtype="string")
-        raw = s.astype(str).str.strip().str.lower()
-        out = raw.where(~raw.str.contains("new", na=False), other="new")
-        out = out.where(~out.str.contains("old", na=False), other="old")
-        return out.str.title()
+        return ChartBuilder._normalize_newold_impl(s)
+
+    @staticmethod
+    def _no_data(height: int = 420) -> Figure:
+        """Lightweight placeholder for empty inputs; skips plotly.express entirely."""
+        return go.Figure(layout=dict(
+            annotations=[dict(text="No data", showarrow=False, xref="paper", yref="paper", x=0.5, y=0.5)],
+            xaxis=dict(visible=False),
+            yaxis=dict(visible=False),
+            height=height,
+            paper_bgcolor="rgba(0,0,0,0)",
+            plot_bgcolor="rgba(0,0,0,0)",
+        ))
+
+    @staticmethod
+    def _normalize_sex_impl(s: pd.Series) -> pd.Series:
+        return _map_uniques(s, lambda v: _SEX_LABELS.get(v.strip().lower(), np.nan))
+
+    @staticmethod
+    def _normalize_newold_impl(s: pd.Series) -> pd.Series:
+        def label(v: str) -> str:
+            v = v.strip().lower()
+            return "New" if "new" in v else "Old" if "old" in v else v.title()
+        return _map_uniques(s, label)
 
     # ==============================================================
     #                           PIE CHART
@@ -63,59 +118,168 @@ class ChartBuilder:
         auto_rotate: bool = True,            # rotate to center largest slice at 12 o'clock
         direction: str = "counterclockwise", # or "clockwise"
     ) -> Figure:
-        total = float(df[values].sum() or 0)
-        if total <= 0:
-            return px.pie(
-                pd.DataFrame({names: [], values: []}),
-                values=values, names=names,
-                color=names,
-                color_discrete_sequence=self.color_theme,
-            )
+        # key the cache on the two columns the pie reads (df_chart also carries Percentage/Label)
+        return _cached_pie(
+            self, df[[names, values]], values, names, title, legend, min_slice_percent_for_label,
+            auto_rotate=auto_rotate, direction=direction,
+        )
 
-        df_sorted = df.sort_values(values, ascending=False).reset_index(drop=True)
-        pct = (df_sorted[values] / total * 100).round(1)
+    def _pie(
+        self,
+        df: pd.DataFrame,
+        values: str,
+        names: str,
+        title: str = "",
+        legend: bool = True,
+        min_slice_percent_for_label: float = 0.7,
+        *,
+        auto_rotate: bool = True,
+        direction: str = "counterclockwise",
+    ) -> Figure:
+        sl = self._pie_slices(df, values, names, min_slice_percent_for_label, auto_rotate)
+        if sl is None:
+            return self._no_data()
+        labels, vals_sorted, text, small, rotation = sl
 
         fig = px.pie(
-            df_sorted,
+            pd.DataFrame({names: labels, values: vals_sorted}),
             values=values,
             names=names,
             color=names,
             color_discrete_sequence=self.color_theme,
         )
 
+        fig.update_traces(
+            **self._pie_trace_style(direction, rotation, text, small),
+            marker=dict(line=dict(color="rgba(0,0,0,0)", width=0)),
+            domain=dict(x=[0, 1], y=[0, 0.95]),
+        )
+
+        fig.update_layout(
+            autosize=True,
+            height=420,
+            width=None,
+            showlegend=bool(legend or small.any()),
+            legend=dict(orientation="h", y=-0.25, x=0.5, xanchor="center", font=dict(size=13)),
+            paper_bgcolor="rgba(0,0,0,0)",
+            plot_bgcolor="rgba(0,0,0,0)",
+            margin=dict(t=60, b=60, l=40, r=40),
+            
+        )
+
+        return fig
+
+    @staticmethod
+    def _pie_slices(df: pd.DataFrame, values: str, names: str, min_slice_percent_for_label: float, auto_rotate: bool):
+        """Slices largest-first with their labels: (labels, values, text, small, rotation), or None if empty."""
+        total = float(df[values].sum() or 0) if not df.empty else 0.0
+        if total <= 0:
+            return None
+        vals = df[values].to_numpy()
+        # descending argsort with the same tie order as df.sort_values(values, ascending=False)
+        order = (len(vals) - 1 - np.argsort(vals[::-1]))[::-1]
+        vals_sorted = vals[order]
+        pct = np.round(vals_sorted / total * 100, 1)
+        text = [f"{v} ({p}%)" for v, p in zip(vals_sorted.tolist(), pct.tolist())]
+        small = pct < min_slice_percent_for_label
         rotation = 0
-        if auto_rotate and len(df_sorted):
-            largest = float(df_sorted.loc[0, values])
+        if auto_rotate and len(vals_sorted):
+            largest = float(vals_sorted[0])
             ang = 360.0 * (largest / total)
             rotation = -ang / 2.0
+        return df[names].to_numpy()[order], vals_sorted, text, small, rotation
 
-        fig.update_traces(
+    @staticmethod
+    def _pie_trace_style(direction: str, rotation: float, text: List[str], small: np.ndarray) -> dict:
+        return dict(
             sort=False,
             direction=direction,
             rotation=rotation,
-            text=df_sorted[values].astype(str) + " (" + pct.astype(str) + "%)",
+            text=text,
             textinfo="text",
             textposition="auto",
             textfont=dict(size=14),
             hovertemplate="<b>%{label}</b><br>Count: %{value}<br>Percent: %{percent}<extra></extra>",
-            pull=[0.02 if p < min_slice_percent_for_label else 0 for p in pct],
+            pull=np.where(small, 0.02, 0.0).tolist(),
             insidetextorientation="auto",
-            marker=dict(line=dict(color="rgba(0,0,0,0)", width=0)),
-            domain=dict(x=[0, 1], y=[0, 0.95]),
         )
 
+    # ==============================================================
+    #                    PIE GRID (SUBPLOTS)
+    # ==============================================================
+
+    def pie_grid(
+        self,
+        items: List[Tuple[str, pd.DataFrame]],
+        values: str,
+        names: str,
+        *,
+        cols: int = 3,
+        row_height: int = 380,
+        min_slice_percent_for_label: float = 0.7,
+        auto_rotate: bool = True,
+        direction: str = "counterclockwise",
+    ) -> Figure:
+        """
+        Several pies as one figure, one subplot domain per (title, df) item, so a section
+        ships a single Plotly payload. Slices are styled like pie(); colours follow the
+        label across pies, so the shared legend reads the same for every subplot.
+        """
+        items = tuple((t, d[[names, values]]) for t, d in items)
+        return _cached_pie_grid(
+            self, items, values, names, cols, row_height, min_slice_percent_for_label,
+            auto_rotate=auto_rotate, direction=direction,
+        )
+
+    def _pie_grid(
+        self,
+        items: Tuple[Tuple[str, pd.DataFrame], ...],
+        values: str,
+        names: str,
+        cols: int = 3,
+        row_height: int = 380,
+        min_slice_percent_for_label: float = 0.7,
+        *,
+        auto_rotate: bool = True,
+        direction: str = "counterclockwise",
+    ) -> Figure:
+        if not items:
+            return self._no_data()
+        cols = max(1, min(cols, len(items)))
+        rows = -(-len(items) // cols)
+        slices = [self._pie_slices(d, values, names, min_slice_percent_for_label, auto_rotate) for _, d in items]
+        fig = make_subplots(
+            rows=rows, cols=cols,
+            specs=[[{"type": "domain"}] * cols for _ in range(rows)],
+            subplot_titles=[t if sl is not None else f"{t} (no data)" for (t, _), sl in zip(items, slices)],
+            vertical_spacing=0.12,
+        )
+        cmap: dict = {}
+        for i, sl in enumerate(slices):
+            if sl is None:
+                continue  # the empty domain keeps its "(no data)" title
+            labels, vals_sorted, text, small, rotation = sl
+            for lab in labels:
+                cmap.setdefault(lab, self.color_theme[len(cmap) % len(self.color_theme)])
+            fig.add_trace(
+                go.Pie(
+                    labels=labels, values=vals_sorted, name=items[i][0],
+                    marker=dict(colors=[cmap[lab] for lab in labels], line=dict(color="rgba(0,0,0,0)", width=0)),
+                    **self._pie_trace_style(direction, rotation, text, small),
+                ),
+                row=i // cols + 1, col=i % cols + 1,
+            )
+        fig.update_annotations(font=dict(size=15))
         fig.update_layout(
             autosize=True,
-            height=420,
+            height=row_height * rows,
             width=None,
-            showlegend=bool(legend or pct.lt(min_slice_percent_for_label).any()),
-            legend=dict(orientation="h", y=-0.25, x=0.5, xanchor="center", font=dict(size=13)),
+            showlegend=True,
+            legend=dict(orientation="h", y=-0.08, x=0.5, xanchor="center", font=dict(size=13)),
             paper_bgcolor="rgba(0,0,0,0)",
             plot_bgcolor="rgba(0,0,0,0)",
             margin=dict(t=60, b=60, l=40, r=40),
-            
         )
-
         return fig
 
     # ==============================================================
@@ -124,8 +288,19 @@ class ChartBuilder:
 
     def bar(
         self, df: pd.DataFrame, x: str, y: str, text: Optional[str] = None,
-        title: str = "", legend: bool = False, height: int = 420
+        title: str = "", legend: bool = False, height: int = 420,
+        category_order: Optional[List[str]] = None,
     ) -> Figure:
+        order = tuple(category_order) if category_order else None
+        return _cached_bar(self, df, x, y, text, title, legend, height, order)
+
+    def _bar(
+        self, df: pd.DataFrame, x: str, y: str, text: Optional[str] = None,
+        title: str = "", legend: bool = False, height: int = 420,
+        category_order: Optional[Tuple[str, ...]] = None,
+    ) -> Figure:
+        if df is None or df.empty or not df[y].sum():
+            return self._no_data(height)
         if text is None:
             text = y
         x_max = df[y].max() or 0
@@ -137,6 +312,7 @@ class ChartBuilder:
             text=text,
             color=x,
             orientation="h",
+            category_orders={x: list(category_order)} if category_order else None,
             color_discrete_sequence=self.color_theme
         )
         fig.update_traces(textposition="outside", cliponaxis=False)
@@ -171,6 +347,8 @@ class ChartBuilder:
         Vertical bar chart with outside labels and headroom.
         Usage: builder.vbar(df, x="Month", y="Surgeries", text="Surgeries", title="Monthly Surgery Trend")
         """
+        if df is None or df.empty or not df[y].sum():
+            return self._no_data(height)
         if text is None:
             text = y
         y_max = float(df[y].max() or 0)
@@ -209,56 +387,204 @@ class ChartBuilder:
         title: str = "", height=420, show_grid=False,
         category_order: Optional[List[str]] = None,
         sex_order: Optional[Tuple[str, ...]] = ("Male", "Female")
+    ) -> Figure:
+        if df is not None and category_col in df.columns and sex_col in df.columns:
+            # hash only the two columns the chart reads, not the whole frame
+            df = df[[category_col, sex_col]]
+        return _cached_grouped_by_category_and_sex(
+            self, df, category_col, sex_col, normalize_category, title, height, show_grid,
+            category_order, sex_order,
+        )
+
+    def _grouped_by_category_and_sex(
+        self, df: pd.DataFrame, category_col: str, sex_col: str,
+        normalize_category: Optional[Callable[[pd.Series], pd.Series]] = None,
+        title: str = "", height=420, show_grid=False,
+        category_order: Optional[List[str]] = None,
+        sex_order: Optional[Tuple[str, ...]] = ("Male", "Female")
     ) -> Figure:
         if df is None or category_col not in df.columns or sex_col not in df.columns:
-            return px.bar(pd.DataFrame(columns=["Category", "Sex", "Count"]))
+            return self._no_data()
 
-        cat = normalize_category(df[category_col]) if normalize_category else df[category_col].astype(str).str.strip().str.title()
         sex = self._normalize_sex_series(df[sex_col])
-        g = pd.DataFrame({"Category": cat, "Sex": sex}).dropna()
-        if g.empty:
-            return px.bar(pd.DataFrame(columns=["Category", "Sex", "Count"]))
+        return self._grouped_impl(
+            df[category_col], sex, category_col, normalize_category,
+            show_grid=show_grid, category_order=category_order, sex_order=sex_order,
+        )
 
-        tbl = g.groupby(["Category", "Sex"], as_index=False).size().rename(columns={"size": "Count"})
+    def _grouped_impl(
+        self, raw_cat: pd.Series, sex: pd.Series, category_col: str,
+        normalize_category: Optional[Callable[[pd.Series], pd.Series]] = None,
+        *, show_grid=False,
+        category_order: Optional[List[str]] = None,
+        sex_order: Optional[Tuple[str, ...]] = ("Male", "Female"),
+    ) -> Figure:
+        cat = normalize_category(raw_cat) if normalize_category else raw_cat.astype(str).str.strip().str.title()
+        keep = (cat.notna() & sex.notna()).to_numpy()
+        if not keep.any():
+            return self._no_data()
+
+        # (category, sex) pair counts via one bincount over packed factorize codes
+        cat_codes, cat_uniq = pd.factorize(cat[keep], sort=True)
+        sex_codes, sex_uniq = pd.factorize(sex[keep], sort=True)
+        n_sex = len(sex_uniq)
+        counts = np.bincount(cat_codes * n_sex + sex_codes, minlength=len(cat_uniq) * n_sex)
+        nz = np.flatnonzero(counts)
+        tbl = pd.DataFrame({
+            "Category": cat_uniq.take(nz // n_sex),
+            "Sex": sex_uniq.take(nz % n_sex),
+            "Count": counts[nz].astype(np.int32),  # dashboard counts fit; halves the trace payload
+        })
         if category_order:
             tbl["Category"] = pd.Categorical(tbl["Category"], categories=category_order, ordered=True)
         if sex_order:
             tbl["Sex"] = pd.Categorical(tbl["Sex"], categories=list(sex_order), ordered=True)
 
-        cmap = {s: self.color_theme[i % len(self.color_theme)] for i, s in enumerate(tbl["Sex"].astype(str).unique())}
+        if set(sex_uniq).issubset(self._sex_cmap):
+            cmap = self._sex_cmap
+        else:
+            cmap = {s: self.color_theme[i % len(self.color_theme)] for i, s in enumerate(tbl["Sex"].astype(str).unique())}
+
+        # Build the traces directly: same output as px.bar(color="Sex", barmode="group")
+        # without plotly.express' grouping and per-property validation.
+        cat_arr = np.asarray(tbl["Category"], dtype=object)
+        sex_arr = np.asarray(tbl["Sex"], dtype=object)
+        cnt = tbl["Count"].to_numpy()
+        text = cnt.astype("U")
+        present = pd.unique(sex_arr[pd.notna(sex_arr)])
+        sex_names = [s for s in sex_order if s in set(present)] if sex_order else list(present)
+
+        traces = []
+        for s in sex_names:
+            m = sex_arr == s
+            traces.append(dict(
+                type="bar", name=s, x=cat_arr[m], y=cnt[m], text=text[m],
+                marker=dict(color=cmap[s]), legendgroup=s, offsetgroup=s, alignmentgroup="True",
+                orientation="v", showlegend=True, textposition="outside", cliponaxis=False,
+                hovertemplate=f"Sex={s}<br>Category=%{{x}}<br>Count=%{{y}}<br>text=%{{text}}<extra></extra>",
+            ))
 
-        fig = px.bar(
-            tbl, x="Category", y="Count", color="Sex", barmode="group",
-            category_orders={"Category": category_order, "Sex": list(sex_order) if sex_order else None},
-            color_discrete_map=cmap,
-            text=tbl["Count"].astype(int).astype(str),
+        y_max = tbl["Count"].max() or 0
+        xaxis = dict(title=dict(text=category_col.replace("_", " ").title()), categoryorder="array", showgrid=show_grid, zeroline=False)
+        if category_order:
+            xaxis["categoryarray"] = list(category_order)
+        layout = dict(
+            barmode="group",
+            legend=dict(title=dict(text="Sex"), tracegroupgap=0),
+            margin=dict(t=60),
+            xaxis=xaxis,
+            yaxis=dict(title=dict(text="Count"), range=[0, y_max + max(int(y_max * 0.2), 5)], showgrid=show_grid, zeroline=False),
         )
+        return go.Figure(dict(data=traces, layout=layout), skip_invalid=True)
 
-        fig.update_traces(textposition="outside", cliponaxis=False)
-        y_max = tbl["Count"].max() or 0
-        fig.update_yaxes(range=[0, y_max + max(int(y_max * 0.2), 5)], showgrid=show_grid, zeroline=False)
-        fig.update_xaxes(title_text=category_col.replace("_", " ").title(), showgrid=show_grid, zeroline=False)
+# ==============================================================
+#                       CACHED BUILDERS
+# ==============================================================
 
-        return fig
+def _hash_frame(d: pd.DataFrame):
+    # Row hashes in order (not summed): pie tie order and bar order follow row order.
+    return (
+        tuple(map(str, d.columns)),
+        tuple(map(str, d.dtypes)),
+        pd.util.hash_pandas_object(d, index=True).values.tobytes(),
+    )
+
+def _hash_series(s: pd.Series):
+    return str(s.name), pd.util.hash_pandas_object(s, index=True).values.tobytes()
+
+def _hash_code(code: types.CodeType):
+    # nested code objects (inner lambdas) by content: their repr carries a memory address
+    consts = tuple(_hash_code(c) if isinstance(c, types.CodeType) else c for c in code.co_consts)
+    return code.co_code, code.co_names, consts
+
+def _cell_value(cell):
+    try:
+        return cell.cell_contents
+    except ValueError:  # empty cell
+        return None
+
+def _hash_function(f: types.FunctionType):
+    # Streamlit hashes functions by id(); page-level lambdas are re-created on every rerun.
+    # Same code with different captured values or defaults must not share a cache entry.
+    return (
+        f.__module__, f.__qualname__, _hash_code(f.__code__),
+        f.__defaults__, f.__kwdefaults__, tuple(_cell_value(c) for c in f.__closure__ or ()),
+    )
+
+_HASH_FUNCS = {
+    pd.DataFrame: _hash_frame,
+    pd.Series: _hash_series,
+    types.FunctionType: _hash_function,
+    ChartBuilder: lambda b: tuple(b.color_theme),
+}
+
+# Bounded: one entry per chart per filter state; pie/bar back most charts on every page.
+@st.cache_data(show_spinner=False, hash_funcs=_HASH_FUNCS, max_entries=128)
+def _cached_pie(builder: ChartBuilder, df: pd.DataFrame, *args, **kwargs) -> Figure:
+    return builder._pie(df, *args, **kwargs)
+
+@st.cache_data(show_spinner=False, hash_funcs=_HASH_FUNCS, max_entries=32)
+def _cached_pie_grid(builder: ChartBuilder, items: tuple, *args, **kwargs) -> Figure:
+    return builder._pie_grid(items, *args, **kwargs)
+
+@st.cache_data(show_spinner=False, hash_funcs=_HASH_FUNCS, max_entries=128)
+def _cached_bar(builder: ChartBuilder, df: pd.DataFrame, *args) -> Figure:
+    return builder._bar(df, *args)
+
+@st.cache_data(show_spinner=False, hash_funcs=_HASH_FUNCS, max_entries=64)
+def _cached_grouped_by_category_and_sex(builder: ChartBuilder, df: pd.DataFrame, *args) -> Figure:
+    return builder._grouped_by_category_and_sex(df, *args)
 
 # ==============================================================
 #                       UTILITIES
 # ==============================================================
 
+def _fig_to_json(fig: Figure) -> str:
+    return pio.to_json(fig, engine=JSON_ENGINE, validate=False)
+
+def _short_digest(data: bytes) -> str:
+    if _xxhash is not None:
+        return _xxhash.xxh3_64(data).hexdigest()[:8]
+    return hashlib.blake2b(data, digest_size=4).hexdigest()
+
+_KEY_TRACE_FIELDS = ("type", "name", "labels", "values", "x", "y")
+
+def _key_value(v):
+    # plain Python values, whether the trace holds arrays or plotly's typed-array dict
+    # ({"dtype", "bdata"}, which is what a figure copied out of st.cache_data carries)
+    if v is None or isinstance(v, str):
+        return v
+    if isinstance(v, dict) and "bdata" in v:
+        v = np.frombuffer(base64.b64decode(v["bdata"]), dtype=v["dtype"])
+    return np.asarray(v).tolist() if hasattr(v, "__len__") else v
+
 def _safe_key_from_fig(fig: Figure, prefix: str = "pie") -> str:
-    j = fig.to_json().encode("utf-8")
-    return f"{prefix}_{hashlib.md5(j).hexdigest()[:8]}"
+    # Fingerprint the title plus each trace's data (not the full JSON with its styling):
+    # two pies with the same title but different slices must get different keys.
+    parts = [repr(fig.layout.title)]
+    for trace in fig.data:
+        parts.extend(repr(_key_value(trace[f] if f in trace else None)) for f in _KEY_TRACE_FIELDS)
+    digest = _short_digest("\x1f".join(parts).encode("utf-8"))
+    return f"{prefix}_{digest}"
+
+@lru_cache(maxsize=1)
+def _plotly_js_src() -> str:
+    # pinned to the installed plotly: plotly-latest is frozen at 1.x and cannot render the
+    # typed-array figure JSON plotly 6 emits; the partial "basic" build covers pie
+    return f"https://cdn.plot.ly/plotly-basic-{po.get_plotlyjs_version()}.min.js"
 
 def plotly_pie_click(fig: Figure, key: Optional[str] = None, height=420, width=420):
     key = key or _safe_key_from_fig(fig, "pie")
-    fig_json = fig.to_json()
+    # JSON data block (not a JS literal); "<\/" keeps a "</script>" inside strings from closing it
+    fig_json = _fig_to_json(fig).replace("</", "<\\/")
     payload = f"""
     <div id="{key}" style="width:100%; max-width:{width}px; height:{height}px;"></div>
-    <script src="https://cdn.plot.ly/plotly-latest.min.js"></script>
+    <script id="{key}-data" type="application/json">{fig_json}</script>
+    <script src="{_plotly_js_src()}"></script>
     <script>
       const mountEl = document.getElementById("{key}");
-      const fig = {fig_json};
-      Plotly.newPlot(mountEl, fig.data, fig.layout, {{displayModeBar:false, responsive:true}});
+      const fig = JSON.parse(document.getElementById("{key}-data").textContent);
+      Plotly.newPlot(mountEl, fig.data, fig.layout, {{displayModeBar:false, responsive:true, plotGlPixelRatio:1}});
       mountEl.on('plotly_click', function(evt){{
         const p = evt?.points?.[0]; if(!p) return;
         const out = {{label:p.label, value:p.value, percent:p.percent, pointNumber:p.pointNumber, curveNumber:p.curveNumber}};
@@ -1,25 +1,53 @@
 # common/config.py
 from pathlib import Path
 from datetime import datetime
+from html import escape
 from typing import Optional, Iterable, Tuple, Dict, Any, List, Union
+import hashlib
 import os
+import threading
+from functools import lru_cache
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import streamlit as st
-from common.helper import to_datetime_safe
+from pandas.api.types import is_datetime64_any_dtype
+from pandas.io.parsers import TextParser
+from common.helper import to_datetime_safe, inject_global_dataframe_css
+
+# Rust-backed xlsx reader; openpyxl stays as the fallback engine.
+try:
+    import python_calamine  # noqa: F401
+    HAS_CALAMINE = True
+except ImportError:
+    HAS_CALAMINE = False
 
 # ---------------- Page-scoped state ----------------
 def _hard_reset_on_page_change(page_key: str, keep: Optional[Iterable[str]] = None) -> None:
     prev = st.session_state.get("_cfg_current_page_key")
     if prev == page_key:
         return
-    keep_keys = set(keep or []) | {"_cfg_current_page_key", "_cfg_filters_css_injected"}
-    for k in list(st.session_state.keys()):
-        if k not in keep_keys:
-            st.session_state.pop(k, None)
+    keep_keys = set(keep or []) | {"_cfg_current_page_key"}
+    for k in set(st.session_state.keys()) - keep_keys:
+        st.session_state.pop(k, None)
     st.session_state["_cfg_current_page_key"] = page_key
 
 # ---------------- Page setup ----------------
+# Styles for render_active_filters. Emitted on every run: elements a rerun doesn't
+# re-emit are dropped by Streamlit, so a once-per-session guard loses the styling.
+_FILTER_CHIP_CSS = """
+<style>
+.cfg-filters { display:flex; flex-wrap:wrap; gap:.5rem 1rem; align-items:center; }
+.cfg-filters .cfg-chip { display:inline-flex; align-items:center; gap:.4rem;
+ padding:.25rem .55rem; border-radius:999px; border:1px solid rgba(2,6,23,0.12);
+ background:rgba(241,245,249,.6); font-size:.92rem; color:#334155; white-space:nowrap; }
+.cfg-filters .cfg-chip b { color:#0f172a; font-weight:700; }
+.cfg-filters h4 { margin:0 0 .35rem 0; font-weight:800; color:#334155; }
+</style>
+"""
+
 def setup_page(
     page_title: str = "📊 Dashboard",
     layout: str = "wide",
@@ -30,12 +58,15 @@ def setup_page(
 ) -> None:
     st.set_page_config(page_title=page_title, layout=layout, initial_sidebar_state=sidebar_state)
     _hard_reset_on_page_change(page_key or page_title, keep_state_keys)
+    st.html(_FILTER_CHIP_CSS)  # style-only html goes to the event container, no layout gap
+    inject_global_dataframe_css()
+
+DATA_DIR = (Path(__file__).parent.parent / "pages" / "data").resolve()
 
 def get_data_path(filename: str, sheet=0) -> Tuple[Path,int]:
-    DATA_PATH = Path(__file__).parent.parent / "pages" / "data" / filename
-    if not DATA_PATH.exists():
-        raise FileNotFoundError(f"Excel file not found at: {DATA_PATH}")
-    return DATA_PATH, sheet
+    # Existence is checked by load_excel, so a missing file surfaces as
+    # load_df_or_stop's st.error instead of an uncaught exception here.
+    return DATA_DIR / filename, sheet
 
 # ---------------- Data helpers ----------------
 def _file_mtime(path: Path | str) -> float:
@@ -44,26 +75,134 @@ def _file_mtime(path: Path | str) -> float:
     except Exception:
         return 0.0
 
-@st.cache_data(show_spinner=False)
-def load_excel(path: Path | str, *, sheet: int | str = 0, _v: float | None = None) -> pd.DataFrame:
-    path = Path(path)
-    if not path.exists():
-        raise FileNotFoundError(f"File not found: {path}")
+# ---------------- Parquet cache ----------------
+# Normalized frames persist across process restarts; set DASHBOARD_NO_CACHE=1 to bypass.
+# Bump PARQUET_CACHE_VERSION whenever _read_excel_normalized changes its output.
+PARQUET_CACHE_DIR = Path(os.getenv("DASHBOARD_CACHE_DIR", Path(__file__).parent / ".cache"))
+PARQUET_CACHE_VERSION = 2
+
+def _parquet_cache_enabled() -> bool:
+    return os.getenv("DASHBOARD_NO_CACHE", "").strip().lower() not in {"1", "true", "yes"}
+
+def _parquet_cache_file(path: Path, sheet: int | str) -> Tuple[Path, str]:
+    st_ = path.stat()
+    source = hashlib.blake2b(f"{path.resolve()}:{sheet}".encode(), digest_size=6).hexdigest()
+    key = hashlib.blake2b(f"{st_.st_mtime_ns}:{st_.st_size}:{PARQUET_CACHE_VERSION}".encode(), digest_size=8).hexdigest()
+    return PARQUET_CACHE_DIR / f"{path.stem}-{source}-{key}.parquet", f"{path.stem}-{source}-*.parquet"
+
+# Text columns come back Arrow-backed (see _read_excel_normalized); numeric ones stay numpy.
+_ARROW_STRING_TYPES = {pa.string(): pd.StringDtype("pyarrow"), pa.large_string(): pd.StringDtype("pyarrow")}
+
+def _read_parquet_cache(cache_file: Path) -> pd.DataFrame:
+    # split_blocks: one 1-D block per column instead of consolidating same-dtype
+    # columns into 2-D blocks (no concatenation copy on load; column scans stay contiguous)
+    return pq.read_table(cache_file).to_pandas(types_mapper=_ARROW_STRING_TYPES.get, split_blocks=True)
+
+def _write_parquet_cache(df: pd.DataFrame, cache_file: Path, stale_glob: str) -> None:
     try:
-        df = pd.read_excel(path, sheet_name=sheet, engine="openpyxl")
+        PARQUET_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # per-writer temp name: an upload-time warm and a dashboard cold start may race
+        tmp = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        df.to_parquet(tmp, engine="pyarrow", compression="zstd")
+        os.replace(tmp, cache_file)
+        for old in PARQUET_CACHE_DIR.glob(stale_glob):
+            if old != cache_file:
+                old.unlink(missing_ok=True)
     except Exception:
-        df = pd.read_excel(path, sheet_name=sheet)
+        pass  # cache is best-effort; the Excel read already succeeded
+
+def warm_parquet_cache(path: Path | str, sheet: int | str = 0) -> bool:
+    """Build the Parquet cache entry for (path, sheet) now, e.g. right after an upload. True if written."""
+    path = Path(path)
+    if not _parquet_cache_enabled() or not path.exists():
+        return False
+    cache_file, stale_glob = _parquet_cache_file(path, sheet)
+    if cache_file.exists():
+        return False
+    _write_parquet_cache(_read_excel_normalized(path, sheet), cache_file, stale_glob)
+    return cache_file.exists()
+
+def _read_sheet_openpyxl(path: Path, sheet: int | str) -> pd.DataFrame:
+    """Stream one sheet through openpyxl's read-only reader (cached values, no formulas)."""
+    import openpyxl
+    # read_only parses sheets lazily, so only the requested one is touched;
+    # keep_links=False skips loading external-workbook link caches
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb[sheet] if isinstance(sheet, str) else wb.worksheets[sheet]
+        rows = list(ws.values)
+    finally:
+        wb.close()  # read-only workbooks keep the zip handle open until closed
+    # read-only sheets may report a stale dimension; drop the blank tail like read_excel does
+    while rows and all(v is None or v == "" for v in rows[-1]):
+        rows.pop()
+    # TextParser is what read_excel uses, so NA strings and dtype inference stay identical
+    with TextParser(rows, header=0) as parser:
+        return parser.read()
+
+def _strip_as_str(s: pd.Series) -> pd.Series:
+    """Same result as s.astype(str).str.strip(), but only the distinct values are touched."""
+    codes, uniques = pd.factorize(s)
+    labels = np.array([str(u).strip() for u in uniques] + ["nan"], dtype=object)  # code -1 -> "nan"
+    return pd.Series(labels[codes], index=s.index, name=s.name)
+
+def _read_excel_normalized(path: Path, sheet: int | str) -> pd.DataFrame:
+    df = None
+    if HAS_CALAMINE:
+        try:
+            df = pd.read_excel(path, sheet_name=sheet, engine="calamine")
+        except Exception:
+            df = None
+    if df is None:
+        try:
+            df = _read_sheet_openpyxl(path, sheet)
+        except Exception:
+            df = pd.read_excel(path, sheet_name=sheet, engine="openpyxl")
     df.columns = [str(c).strip().lower() for c in df.columns]
+    # Arrow-backed strings: contiguous buffers, and isin/value_counts/.str run as Arrow kernels
     for c in df.select_dtypes(include="object").columns:
-        df[c] = df[c].astype(str).str.strip()
+        df[c] = _strip_as_str(df[c]).astype("string[pyarrow]")
     return df
 
+# cache_resource hands every session the same frame instead of a per-call copy:
+# callers must treat loaded frames as read-only (copy before assigning columns).
+@st.cache_resource(show_spinner=False, max_entries=8)
+def load_excel(path: Path | str, *, sheet: int | str = 0, mtime: float | None = None) -> pd.DataFrame:
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(f"File not found: {path}")
+    if not _parquet_cache_enabled():
+        return _read_excel_normalized(path, sheet)
+    cache_file, stale_glob = _parquet_cache_file(path, sheet)
+    if cache_file.exists():
+        try:
+            return _read_parquet_cache(cache_file)
+        except Exception:
+            pass
+    df = _read_excel_normalized(path, sheet)
+    _write_parquet_cache(df, cache_file, stale_glob)
+    return df
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _load_excel_with_dates(path: Path | str, sheet: int | str, date_col: str, mtime: float | None) -> pd.DataFrame:
+    df = load_excel(path, sheet=sheet, mtime=mtime)
+    if is_datetime64_any_dtype(df[date_col]):
+        return df
+    out = df.copy(deep=False)  # new column list, other columns still shared with df
+    out[date_col] = to_datetime_safe(df[date_col])
+    return out
+
 def pick_column(candidates: Iterable[str], columns: set[str]) -> Optional[str]:
     return next((c for c in candidates if c in columns), None)
 
+@lru_cache(maxsize=64)
+def _resolved_cols_cached(cols: frozenset, candidates: Tuple[Tuple[str, Tuple[str, ...]], ...]) -> Tuple[Tuple[str, Optional[str]], ...]:
+    return tuple((key, pick_column(cands, cols)) for key, cands in candidates)
+
 def resolved_cols(df: pd.DataFrame, candidates: Dict[str, Iterable[str]]) -> Dict[str, Optional[str]]:
-    cols = set(df.columns)
-    return {key: pick_column(cands, cols) for key, cands in candidates.items()}
+    # same columns + candidates on every rerun, so resolve once per process
+    key = tuple((k, tuple(v)) for k, v in candidates.items())
+    return dict(_resolved_cols_cached(frozenset(df.columns), key))
 
 def load_df_or_stop(
     data_path: Path | str,
@@ -72,34 +211,19 @@ def load_df_or_stop(
     candidates: Optional[Dict[str, Iterable[str]]] = None,
     date_key: str = "date",
 ) -> Tuple[pd.DataFrame, Dict[str, Optional[str]]]:
+    mtime = _file_mtime(data_path)
     try:
-        df = load_excel(data_path, sheet=sheet, _v=_file_mtime(data_path))
+        df = load_excel(data_path, sheet=sheet, mtime=mtime)
     except Exception as e:
         st.error(f"Could not load Excel file at {data_path}.\n{e}")
         st.stop()
     RES: Dict[str, Optional[str]] = resolved_cols(df, candidates) if candidates else {}
     date_col = RES.get(date_key) if RES else None
     if isinstance(date_col, str) and date_col in df.columns:
-        df[date_col] = to_datetime_safe(df[date_col])
+        df = _load_excel_with_dates(data_path, sheet, date_col, mtime)
     return df, RES
 
 # ---------------- Active filters ----------------
-def _ensure_chip_css_once() -> None:
-    key = "_cfg_filters_css_injected"
-    if st.session_state.get(key):
-        return
-    st.session_state[key] = True
-    st.markdown("""
-<style>
-.cfg-filters { display:flex; flex-wrap:wrap; gap:.5rem 1rem; align-items:center; }
-.cfg-filters .cfg-chip { display:inline-flex; align-items:center; gap:.4rem;
- padding:.25rem .55rem; border-radius:999px; border:1px solid rgba(2,6,23,0.12);
- background:rgba(241,245,249,.6); font-size:.92rem; color:#334155; white-space:nowrap; }
-.cfg-filters .cfg-chip b { color:#0f172a; font-weight:700; }
-.cfg-filters h4 { margin:0 0 .35rem 0; font-weight:800; color:#334155; }
-</style>
-""", unsafe_allow_html=True)
-
 def _normalize_filters(active_filters: Union[Dict[str, Any], Iterable[Tuple[str, Any]], None]) -> List[Tuple[str,str]]:
     if not active_filters: return []
     items = active_filters.items() if isinstance(active_filters, dict) else list(active_filters)
@@ -120,14 +244,22 @@ def render_active_filters(active_filters: Union[Dict[str, Any], Iterable[Tuple[s
                           separator_html: str="&nbsp;&nbsp;&nbsp;") -> None:
     pairs = _normalize_filters(active_filters)
     if not pairs: return
-    _ensure_chip_css_once()
-    parts = [f'<span class="cfg-chip"><b>{k}</b>: {v}</span>' for k,v in pairs]
-    interleaved = [p + (separator_html if i<len(parts)-1 else "") for i,p in enumerate(parts)]
-    if show_heading:
-        st.markdown(f'<div class="cfg-filters"><h4>{heading_text}</h4></div>', unsafe_allow_html=True)
-    st.markdown('<div class="cfg-filters">'+"".join(interleaved)+"</div>", unsafe_allow_html=True)
+    chips = separator_html.join(f'<span class="cfg-chip"><b>{escape(k)}</b>: {escape(v)}</span>' for k,v in pairs)
+    heading = f'<div class="cfg-filters"><h4>{escape(heading_text)}</h4></div>' if show_heading else ""
+    st.markdown(f'{heading}<div class="cfg-filters">{chips}</div>', unsafe_allow_html=True)
 
 # ---------------- Shared Header ----------------
+def _csv_key(df: pd.DataFrame) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((list(map(str, df.columns)), list(map(str, df.dtypes)))).encode())
+    h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return h.hexdigest()
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _df_to_csv_bytes(key: str, _df: pd.DataFrame) -> bytes:
+    # keyed on the content digest; hashing rows is far cheaper than re-serializing them
+    return _df.to_csv(index=False).encode("utf-8")
+
 def render_page_header(title: str, data_path: Path | str, df: Optional[pd.DataFrame]=None,
                        col_spec: list[int]=[3,2,2,3],
                        *, active_filters: Union[Dict[str, Any], Iterable[Tuple[str, Any]], None]=None,
@@ -144,5 +276,5 @@ def render_page_header(title: str, data_path: Path | str, df: Optional[pd.DataFr
         if active_filters:
             render_active_filters(active_filters, heading_text="Active filters", show_heading=show_filters_heading)
         if df is not None and not df.empty:
-            csv_bytes = df.to_csv(index=False).encode("utf-8")
+            csv_bytes = _df_to_csv_bytes(_csv_key(df), df)
     return csv_bytes
@@ -1,7 +1,10 @@
 # app.py
 import streamlit as st
+import numpy as np
 import pandas as pd
-from typing import List, Dict, Any, Tuple
+from datetime import date
+from pandas.api.types import is_datetime64_any_dtype
+from typing import List, Dict, Any, Tuple, Optional
 
 st.set_page_config(layout="wide")
 
@@ -10,24 +13,33 @@ def _col_present(df: pd.DataFrame, col: Any) -> bool:
     return isinstance(col, str) and df is not None and col in df.columns
 
 def _to_datetime(s: pd.Series) -> pd.Series:
+    # load_df_or_stop already parsed the date column; don't reparse it on every rerun
+    if is_datetime64_any_dtype(s): return s
     return pd.to_datetime(s, errors="coerce")
 
+def _date_bounds(col_dt: pd.Series) -> Tuple[Optional[date], Optional[date]]:
+    mn, mx = col_dt.min(), col_dt.max()  # NaT-skipping reductions, no extra notna() pass
+    if pd.isna(mn): return None, None
+    return mn.date(), mx.date()
+
 def _init_session_for_filters(df: pd.DataFrame, col_mapping: Dict[str, str], filter_order: List[Dict[str, Any]]) -> None:
     for f in filter_order:
         key = f.get("session_key") or f["col"]
         typ = f.get("type", "multiselect")
         if typ == "date":
             col = col_mapping.get(f["col"])
-            dt = _to_datetime(df[col].dropna()) if _col_present(df, col) else pd.Series([], dtype="datetime64[ns]")
-            st.session_state.setdefault(key, (dt.min().date() if not dt.empty else None, dt.max().date() if not dt.empty else None))
+            bounds = _date_bounds(_to_datetime(df[col])) if _col_present(df, col) else (None, None)
+            st.session_state.setdefault(key, bounds)
         else:
             st.session_state.setdefault(key, [])
 
 # ---------------- Filters ----------------
-def _apply_date_filter(subset: pd.DataFrame, col: str, key: str, label: str, selections: Dict[str, Any]) -> pd.DataFrame:
-    col_dt = _to_datetime(subset[col])
-    if not col_dt.notna().any(): return subset
-    mn, mx = col_dt.min().date(), col_dt.max().date()
+# Each filter sees only the rows kept so far (so option lists cascade) and returns a
+# boolean keep-array over that column, or None when it does not filter anything.
+def _apply_date_filter(s: pd.Series, key: str, label: str, selections: Dict[str, Any]) -> Optional[np.ndarray]:
+    col_dt = _to_datetime(s)
+    mn, mx = _date_bounds(col_dt)
+    if mn is None: return None
     default_start, default_end = st.session_state.setdefault(key, (mn, mx))
 
     with st.sidebar.expander(label, expanded=False):
@@ -41,21 +53,35 @@ def _apply_date_filter(subset: pd.DataFrame, col: str, key: str, label: str, sel
 
     start_dt = pd.Timestamp(start).normalize()
     end_dt   = pd.Timestamp(end).normalize() + pd.Timedelta(days=1) - pd.Timedelta(microseconds=1)
-    return subset[(col_dt >= start_dt) & (col_dt <= end_dt)].copy()
+    # compare on the int64 nanosecond view; NaT is int64 min, so it falls outside any range
+    ns = col_dt.to_numpy(dtype="datetime64[ns]").view("i8")
+    return (ns >= start_dt.value) & (ns <= end_dt.value)
 
-def _apply_multiselect_filter(subset: pd.DataFrame, col: str, key: str, label: str, selections: Dict[str, Any]) -> pd.DataFrame:
+def _apply_multiselect_filter(s: pd.Series, key: str, label: str, selections: Dict[str, Any]) -> Optional[np.ndarray]:
     with st.sidebar.expander(label, expanded=False):
-        s = subset[col].fillna("unknown")
-        options = list(s.value_counts().sort_index().index)
-        current = [v for v in st.session_state.setdefault(key, []) if v in options]
-        sel = st.multiselect("Choose", options=options, default=current, key=key,
-                             format_func=lambda v: f"{v} ({int(s.value_counts().get(v,0))})")
+        is_cat = isinstance(s.dtype, pd.CategoricalDtype)
+        if s.hasnans:
+            if is_cat and "unknown" not in s.cat.categories:
+                s = s.cat.add_categories("unknown")
+            s = s.fillna("unknown")
+        counts = s.value_counts().sort_index()
+        if is_cat:
+            counts = counts[counts > 0]  # categoricals also report categories filtered away upstream
+        options = list(counts.index)
+        # format_func runs per option per render: hand it a prebuilt dict's bound .get
+        labels = {v: f"{v} ({n})" for v, n in zip(options, counts.tolist())}
+        current = [v for v in st.session_state.setdefault(key, []) if v in labels]
+        sel = st.multiselect("Choose", options=options, default=current, key=key, format_func=labels.get)
     selections[key] = ", ".join(map(str, sel)) if sel else ""
-    return subset[s.isin(sel)].copy() if sel else subset
+    return s.isin(sel).to_numpy() if sel else None
 
 # ---------------- Main ----------------
+def filter_signature(filter_order: List[Dict[str, Any]]) -> Tuple[Tuple[str, str], ...]:
+    """Hashable snapshot of the current filter widget values, for keying caches on the filtered frame."""
+    keys = [f.get("session_key") or f["col"] for f in filter_order]
+    return tuple((k, repr(st.session_state.get(k))) for k in keys)
+
 def dynamic_sidebar_filters(df: pd.DataFrame, col_mapping: Dict[str, str], filter_order: List[Dict[str, Any]]) -> Tuple[pd.DataFrame, Dict[str, Any]]:
-    subset = df.copy()
     selections: Dict[str, Any] = {}
 
     def clear_filters():
@@ -72,13 +98,19 @@ def dynamic_sidebar_filters(df: pd.DataFrame, col_mapping: Dict[str, str], filte
     if any((f.get("session_key") or f["col"]) not in st.session_state for f in filter_order):
         _init_session_for_filters(df, col_mapping, filter_order)
 
+    # Kept rows as positions into df (None = all rows): each filter slices only its own
+    # column, the positions shrink as filters apply, and the frame is gathered once.
+    rows = None
     for f in filter_order:
         key = f.get("session_key") or f["col"]
         col = col_mapping.get(f["col"])
-        if not _col_present(subset, col): continue
+        if not _col_present(df, col): continue
+        s = df[col] if rows is None else df[col].take(rows)
         if f.get("type", "multiselect") == "date":
-            subset = _apply_date_filter(subset, col, key, f.get("label", key), selections)
+            keep = _apply_date_filter(s, key, f.get("label", key), selections)
         else:
-            subset = _apply_multiselect_filter(subset, col, key, f.get("label", key), selections)
+            keep = _apply_multiselect_filter(s, key, f.get("label", key), selections)
+        if keep is not None and not keep.all():  # the default full date range keeps every row
+            rows = np.flatnonzero(keep) if rows is None else rows[keep]
 
-    return subset, selections
+    return (df if rows is None else df.take(rows)), selections
@@ -1,46 +1,77 @@
+from contextlib import nullcontext
 from datetime import date
+from html import escape
 import pandas as pd
 import numpy as np
 from typing import Optional, Set
 import streamlit as st
 
+# Arrow-backed strings run .str/.isin as Arrow compute kernels; numpy-object StringDtype otherwise.
+try:
+    import pyarrow  # noqa: F401
+    _STR_DTYPE = "string[pyarrow]"
+except ImportError:
+    _STR_DTYPE = "string"
+
 # -------------------- Date utils --------------------
 def to_datetime_safe(series) -> pd.Series:
     """Convert input to datetime safely."""
-    return pd.to_datetime(pd.Series(series), errors="coerce") if series is not None else pd.Series([], dtype="datetime64[ns]")
+    if series is None:
+        return pd.Series([], dtype="datetime64[ns]")
+    if isinstance(series, pd.Series) and series.dtype == "datetime64[ns]":
+        return series  # already parsed: no re-wrap, no reparse
+    return pd.to_datetime(pd.Series(series), errors="coerce")
 
 # -------------------- Column helpers --------------------
 def have_cols(df: pd.DataFrame, cols) -> bool:
     """Check if df has all specified columns."""
     if df is None or df.empty:
         return False
+    columns = df.columns  # Index membership is a hash lookup; just fetch it once
     if isinstance(cols, (list, tuple)):
-        return all(c in df.columns for c in cols)
-    return cols in df.columns
+        return all(c in columns for c in cols)
+    return cols in columns
+
+_EMPTY_SERIES = pd.Series([], dtype="object")  # shared miss value; treat as read-only
 
 def safe_series(df: Optional[pd.DataFrame], col: Optional[str]) -> pd.Series:
     """Return df[col] if exists, else empty Series."""
-    if df is None or col is None or col not in df.columns:
-        return pd.Series([], dtype="object")
-    s = df[col]
-    return pd.Series(s) if isinstance(s, (list, np.ndarray)) else s
+    if df is None or col is None:
+        return _EMPTY_SERIES
+    s = df.get(col)  # one lookup instead of membership test + __getitem__
+    return _EMPTY_SERIES if s is None else s
 
 # -------------------- Cleaning / counts --------------------
 def clean_referrals(s) -> pd.Series:
     """Remove blanks, 'nan', NaN."""
     if s is None:
         return pd.Series([], dtype="object")
-    s = pd.Series(s).astype("string").str.strip()
-    s = s.mask(s.str.lower() == "nan", pd.NA).dropna()
-    return s[s != ""]
+    s = pd.Series(s)
+    # strip and test the distinct values only, then gather the kept rows by code
+    codes, uniques = pd.factorize(s)
+    u = pd.Index(uniques).astype(_STR_DTYPE).str.strip()
+    ok = ((u != "") & (u.str.lower() != "nan")).to_numpy(dtype=bool, na_value=False)
+    rows = np.flatnonzero(np.append(ok, False)[codes])  # code -1 (NaN) hits the trailing False
+    return pd.Series(u[codes[rows]], index=s.index[rows], name=s.name)
+
+def _count_values(counts: pd.Series) -> np.ndarray:
+    return np.nan_to_num(pd.to_numeric(counts.values, errors="coerce")).astype(int)
+
+def count_total(counts) -> int:
+    """Sum of counts as make_count_df sees it (non-numeric/NaN count as 0)."""
+    if counts is None or len(counts) == 0:
+        return 0
+    counts = counts if isinstance(counts, pd.Series) else pd.Series(counts)
+    return int(_count_values(counts).sum())
 
-def make_count_df(counts) -> pd.DataFrame:
-    """Build count+percentage dataframe."""
+def make_count_df(counts, total: Optional[int] = None) -> pd.DataFrame:
+    """Build count+percentage dataframe; pass total if already known (see count_total)."""
     counts = pd.Series(counts) if counts is not None and not isinstance(counts, pd.Series) else counts
     if counts is None or counts.empty:
         return pd.DataFrame(columns=["Category","Count","Percentage"])
-    vals = np.nan_to_num(pd.to_numeric(counts.values, errors="coerce")).astype(int)
-    total = vals.sum()
+    vals = _count_values(counts)
+    if total is None:
+        total = vals.sum()
     if total == 0:
         return pd.DataFrame(columns=["Category","Count","Percentage"])
     pct = np.round(vals / total * 100, 1)
@@ -49,33 +80,38 @@ def make_count_df(counts) -> pd.DataFrame:
 
 def category_counts_present(df_all, df_present, col: Optional[str], drop_values: Optional[Set[str]] = None, exclude_values: Optional[Set[str]] = None) -> pd.Series:
     """Counts for a column restricted to a subset, preserving all categories."""
-    s_all = safe_series(df_all, col).astype("string")
-    s_pre = safe_series(df_present, col).astype("string")
+    s_all = safe_series(df_all, col)
+    s_pre = safe_series(df_present, col)
     if s_all.empty or s_pre.empty:
         return pd.Series(dtype="int")
-    if drop_values:
-        s_all = s_all[~s_all.isin(drop_values)]
-        s_pre = s_pre[~s_pre.isin(drop_values)]
-    if exclude_values:
-        s_all = s_all[~s_all.isin(exclude_values)]
-        s_pre = s_pre[~s_pre.isin(exclude_values)]
-    return s_pre.value_counts().reindex(sorted(s_all.unique()), fill_value=0).astype(int)
+    # Factorize both once; string labels, drops and sort order are then handled on
+    # the K distinct values only, and counting is a bincount over the codes.
+    n_all = len(s_all)
+    codes, uniques = pd.factorize(pd.concat([s_all, s_pre], ignore_index=True))
+    lab_codes, cats = pd.factorize(pd.Index(uniques).astype(_STR_DTYPE), sort=True)
+    codes = np.where(codes >= 0, lab_codes[codes], -1)
+    c_all, c_pre = codes[:n_all], codes[n_all:]
+    keep = np.bincount(c_all[c_all >= 0], minlength=len(cats)) > 0
+    skip = set(drop_values or ()) | set(exclude_values or ())
+    if skip:
+        keep &= ~np.asarray(cats.isin(skip), dtype=bool)
+    counts = np.bincount(c_pre[c_pre >= 0], minlength=len(cats))
+    return pd.Series(counts[keep], index=pd.Index(cats[keep], dtype=object, name=col), name="count")
 
 # -------------------- Label helpers --------------------
-def add_bar_labels(df: pd.DataFrame) -> pd.DataFrame:
-    """Add 'Label' column like '123 (45.6%)'."""
+def add_bar_labels(df: pd.DataFrame, *, copy: bool = True) -> pd.DataFrame:
+    """Add 'Label' column like '123 (45.6%)'; copy=False labels df in place."""
     if df is None or df.empty:
         return df
-    df_out = df.copy()
+    df_out = df.copy() if copy else df
     df_out["Count"] = pd.to_numeric(df_out.get("Count",0), errors="coerce").fillna(0).astype(int)
     df_out["Percentage"] = pd.to_numeric(df_out.get("Percentage",0.0), errors="coerce").fillna(0.0)
-    df_out["Label"] = df_out.apply(lambda r: f"{int(r['Count'])} ({round(r['Percentage'],1)}%)", axis=1)
+    # one comprehension over plain Python scalars instead of a row-wise apply
+    df_out["Label"] = [f"{c} ({round(p, 1)}%)" for c, p in zip(df_out["Count"].tolist(), df_out["Percentage"].tolist())]
     return df_out
 
 # -------------------- UI helpers --------------------
-def metric_card(title: str, value: str, help_text: Optional[str] = None, icon: str = "", color: str = "#2563eb", container=None):
-    """Render simple metric card (Streamlit or HTML)."""
-    html = f"""
+_CARD_HTML = """
 <div style="border:1px solid rgba(2,6,23,0.08);border-radius:14px;padding:12px 14px;background:#fff;
 box-shadow:0 1px 1.5px rgba(2,6,23,.06),0 8px 18px rgba(2,6,23,.04);">
   <div style="display:flex;align-items:center;gap:8px;margin-bottom:4px;">
@@ -83,22 +119,58 @@ box-shadow:0 1px 1.5px rgba(2,6,23,.06),0 8px 18px rgba(2,6,23,.04);">
     <span style="font-weight:700;color:#334155;">{title}</span>
   </div>
   <div style="font-size:1.25rem;font-weight:800;color:{color};">{value}</div>
-  {f'<div style="margin-top:4px;font-size:.9rem;color:#64748b;">{help_text}</div>' if help_text else ''}
+  {help_block}
 </div>
 """
-    try:
-        if container and hasattr(container, "markdown"):
-            container.markdown(html, unsafe_allow_html=True)
-        else:
-            st.markdown(html, unsafe_allow_html=True)
-    except Exception:
-        pass
+_CARD_HELP_HTML = '<div style="margin-top:4px;font-size:.9rem;color:#64748b;">{help_text}</div>'
+# One flex row replaces st.columns for a batch of cards (wraps on narrow screens like columns do).
+_CARD_ROW_HTML = '<div style="display:flex;flex-wrap:wrap;gap:1rem;">{cards}</div>'
+_CARD_CELL_HTML = '<div style="flex:1 1 0;min-width:12rem;">{card}</div>'
+
+def _card_html(title: str, value, help_text: Optional[str] = None, icon: str = "", color: str = "#2563eb") -> str:
+    help_block = _CARD_HELP_HTML.format(help_text=help_text) if help_text else ""
+    return _CARD_HTML.format(icon=icon, title=title, color=color, value=value, help_block=help_block)
+
+def _compact_html(html: str) -> str:
+    # one line: a blank line inside markdown would end the HTML block
+    return "".join(line.strip() for line in html.splitlines())
+
+def metric_card(title: str, value: str, help_text: Optional[str] = None, icon: str = "", color: str = "#2563eb", container=None):
+    """Render simple metric card (Streamlit or HTML)."""
+    html = _card_html(title, value, help_text, icon, color)
+    target = container if container is not None and hasattr(container, "markdown") else st
+    target.markdown(html, unsafe_allow_html=True)
+
+def section(title: str) -> None:
+    """Section divider + subheader (st.markdown("---") then st.subheader) as one element."""
+    st.html(f"<hr><h3>{escape(title)}</h3>")
 
 # Helpers
+_DONE_STRINGS = frozenset({"yes","y","true","1"})
+_MALE_STRINGS = frozenset({"male","m","man","boy"})
+_FEMALE_STRINGS = frozenset({"female","f","woman","girl"})
+
 def is_done(val):
     if pd.isna(val): return False
     if isinstance(val, (bool, int, float,date)): return bool(val)
-    return str(val).strip().lower() in {"yes","y","true","1"}
+    return str(val).strip().lower() in _DONE_STRINGS
+
+def text_isin(s: pd.Series, values: frozenset) -> pd.Series:
+    """s.astype(str).str.strip().str.lower().isin(values) as a bool Series, tested per distinct value."""
+    codes, uniques = pd.factorize(s)
+    flags = np.array([str(u).strip().lower() in values for u in uniques] + ["nan" in values], dtype=bool)  # code -1 (NA) -> "nan"
+    return pd.Series(flags[codes], index=s.index, name=s.name)
+
+def is_done_series(s: pd.Series) -> pd.Series:
+    """Vectorized is_done: same truth value per cell, as a bool Series."""
+    if pd.api.types.is_bool_dtype(s) or pd.api.types.is_numeric_dtype(s):
+        return (s.notna() & (s != 0)).astype(bool)
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s.notna()
+    # text / mixed: run the scalar rule over the distinct values only
+    codes, uniques = pd.factorize(s)
+    flags = np.array([is_done(u) for u in uniques] + [False], dtype=bool)  # code -1 (NA) -> False
+    return pd.Series(flags[codes], index=s.index, name=s.name)
 
 def render_metric_cards(
     metrics: dict[str, tuple[str, str | None]],
@@ -107,7 +179,9 @@ def render_metric_cards(
     *,
     is_done_fn=is_done,
     metric_card_fn=metric_card,
-    columns=None
+    columns=None,
+    done_masks: dict[str, pd.Series] | None = None,
+    lead_cards: list[str] | None = None
 ) -> None:
     """
     Render metric cards from a spec dict:
@@ -116,27 +190,52 @@ def render_metric_cards(
     - Shows total count per metric.
     - If base_col is provided, shows 'count (pct%)' where pct = count/base*100.
     - If a sex column exists, adds help_text 'M:x | F:y'.
+    - done_masks: optional {col: is_done_series(df[col])} the page already built.
+    - lead_cards: optional page-built card HTML placed first in the same row (batched layout only).
     """
     sex_col = res.get("sex")
-    # Optional: use provided columns layout, else auto-create
-    cols = columns or st.columns(len(metrics))
+    # Default layout: all cards in one markdown call. A custom card fn or an explicit
+    # columns layout keeps the one-card-per-column rendering.
+    batched = columns is None and metric_card_fn is metric_card
+    cols = [None] * len(metrics) if batched else (columns or st.columns(len(metrics)))
+    cards: list[str] = [_CARD_CELL_HTML.format(card=_compact_html(h)) for h in (lead_cards or [])] if batched else []
+
+    # one is_done pass per referenced column, shared by counts, bases and the M/F split
+    needed = {c for c, base in metrics.values()} | {base for _, base in metrics.values() if base}
+    done_of = is_done_series if is_done_fn is is_done else (lambda s: s.apply(is_done_fn))
+    done_masks = done_masks if is_done_fn is is_done else None
+    done = {
+        c: (done_masks[c] if done_masks and c in done_masks else done_of(df[c])).to_numpy(dtype=bool)
+        for c in needed if c in df.columns
+    }
+
+    # sex as int8 codes (0=other, 1=male, 2=female), normalized once over the distinct values
+    sex_codes = None
+    if sex_col and sex_col in df.columns:
+        codes, uniques = pd.factorize(df[sex_col])
+        keys = [str(u).strip().lower() for u in uniques] + ["nan"]
+        lut = np.array([1 if k in _MALE_STRINGS else 2 if k in _FEMALE_STRINGS else 0 for k in keys], dtype=np.int8)
+        sex_codes = lut[codes]
+
+    # every metric's done-count split by sex code (one bincount each); the codes
+    # partition the rows, so each split also sums to the total
+    if sex_codes is not None:
+        by_sex_of = {c: np.bincount(sex_codes[m], minlength=3) for c, m in done.items()}
+    else:
+        by_sex_of = {c: np.array([np.count_nonzero(m)]) for c, m in done.items()}
 
     def _count_done(col: str) -> int:
-        return df[col].apply(is_done_fn).sum() if col in df.columns else 0
+        return int(by_sex_of[col].sum()) if col in by_sex_of else 0
 
     for col_block, (title, (col_name, base_col)) in zip(cols, metrics.items()):
-        with col_block:
+        with col_block or nullcontext():
             # main value
             val = _count_done(col_name)
             # gender breakdown
             help_txt = ""
-            if sex_col and sex_col in df.columns and col_name in df.columns:
-                done_data = df[df[col_name].apply(is_done_fn)]
-                if not done_data.empty:
-                    s = done_data[sex_col].astype(str).str.strip().str.lower()
-                    m = int(s.isin({"male","m","man","boy"}).sum())
-                    w = int(s.isin({"female","f","woman","girl"}).sum())
-                    help_txt = f"M:{m} | F:{w}"
+            if sex_codes is not None and val:
+                by_sex = by_sex_of[col_name]
+                help_txt = f"M:{int(by_sex[1])} | F:{int(by_sex[2])}"
 
             # percentage vs base (if provided)
             display_val = val
@@ -145,7 +244,14 @@ def render_metric_cards(
                 pct = (val / base_val * 100.0) if base_val else 0.0
                 display_val = f"{val} ({pct:.1f}%)"
 
-            metric_card_fn(title, display_val, help_text=help_txt)
+            if batched:
+                cards.append(_CARD_CELL_HTML.format(card=_compact_html(_card_html(title, display_val, help_txt))))
+            else:
+                metric_card_fn(title, display_val, help_text=help_txt)
+
+    if batched and cards:
+        # st.html: the row is plain HTML, so skip the markdown parser entirely
+        st.html(_CARD_ROW_HTML.format(cards="".join(cards)))
 
 # -------------------- Global dataframe CSS --------------------
 _DATAFRAME_CSS = """
@@ -156,12 +262,6 @@ span[data-testid="stHeaderActionElements"] { display:none !important; }
 </style>
 """
 
-def inject_global_dataframe_css(state_key: str="_global_df_css_injected"):
-    """Inject shared st.dataframe CSS once per session."""
-    try:
-        import streamlit as st
-        if not st.session_state.get(state_key):
-            st.session_state[state_key] = True
-            st.markdown(_DATAFRAME_CSS, unsafe_allow_html=True)
-    except Exception:
-        pass
+def inject_global_dataframe_css():
+    """Emit shared st.dataframe CSS. Call on every run (setup_page does)."""
+    st.html(_DATAFRAME_CSS)
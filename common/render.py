@@ -1,22 +1,58 @@
-import pandas as pd
 import streamlit as st
-from common.helper import add_bar_labels, category_counts_present, have_cols, make_count_df
+from common.helper import add_bar_labels, category_counts_present, count_total, have_cols, make_count_df
 
 # ---- theme-aware text color ----
 def get_theme_text_color():
+    # resolved once per session; st.get_option walks the config resolver on every call
+    color = st.session_state.get("_theme_text_color")
+    if color:
+        return color
     try:
-        return "#FAFAFA" if (st.get_option("theme.base") or "light").lower() == "dark" else "#1D7C48"
+        color = "#FAFAFA" if (st.get_option("theme.base") or "light").lower() == "dark" else "#1D7C48"
     except Exception:
-        return "#111827"
+        color = "#111827"
+    st.session_state["_theme_text_color"] = color
+    return color
 
-def _show_chart(container, title, fig):
+_TITLE_HTML = "<h5 style='text-align:center;color:{color};'>{title}</h5>"
+
+def _show_chart(container, title, fig, color=None):
+    # Title and chart share the spec's own container (usually an st.columns cell),
+    # so titles can't be merged into one page-level markdown call.
     with container:
-        st.markdown(
-            f"<h5 style='text-align:center;color:{get_theme_text_color()};'>{title}</h5>",
-            unsafe_allow_html=True,
-        )
+        if title:
+            st.markdown(_TITLE_HTML.format(color=color or get_theme_text_color(), title=title), unsafe_allow_html=True)
         st.plotly_chart(fig, use_container_width=True)
 
+def _show_msg(container, msg_fn, text):
+    with container:
+        msg_fn(text)
+
+def _emit(pending, fn, *args):
+    # With a pending list (render_many), output is queued and flushed after every figure is built
+    if pending is None:
+        fn(*args)
+    else:
+        pending.append((fn, args))
+
+@st.cache_data(show_spinner=False, max_entries=128)
+def _cached_counts(cache_key, col, drop_values: frozenset, exclude_values: frozenset, _df_all, _df_present):
+    # cache_key stands in for the (unhashed) frames; see render_many
+    return category_counts_present(_df_all, _df_present, col, drop_values=set(drop_values), exclude_values=set(exclude_values))
+
+def _counts(df_all, df_present, col, drop_values, exclude_values, cache_key=None):
+    if cache_key is not None:
+        return _cached_counts(
+            cache_key, col, frozenset(drop_values or ()), frozenset(exclude_values or ()), df_all, df_present,
+        )
+    return category_counts_present(
+        df_all,
+        df_present,
+        col,
+        drop_values=set(drop_values or []),
+        exclude_values=set(exclude_values or []),
+    )
+
 # ---- single distribution renderer ----
 def render_distribution(
     container,
@@ -36,19 +72,24 @@ def render_distribution(
     sex_col: str | None = None,
     normalize_category=None,
     chart_kwargs: dict | None = None,
+    _cols_all: frozenset | None = None,
+    _title_color: str | None = None,
+    _pending: list | None = None,
+    _cache_key=None,
 ):
+    # _cols_all / _title_color: per-page invariants precomputed by render_many;
+    # _pending: render_many's output queue (see _emit); _cache_key: see render_many
     chart_kwargs = chart_kwargs or {}
+    has_col = (lambda c: c in _cols_all) if _cols_all is not None else (lambda c: have_cols(df_all, c))
 
-    if df_present.empty or not have_cols(df_all, col):
-        with container:
-            st.info(info_text or f"No data for column: {col}")
+    if df_present.empty or not has_col(col):
+        _emit(_pending, _show_msg, container, st.info, info_text or f"No data for column: {col}")
         return
 
     # Grouped-by-sex path
     if kind == "grouped_sex":
-        if not sex_col or not have_cols(df_all, sex_col):
-            with container:
-                st.info(info_text or f"No data for columns: {col} and/or {sex_col}")
+        if not sex_col or not has_col(sex_col):
+            _emit(_pending, _show_msg, container, st.info, info_text or f"No data for columns: {col} and/or {sex_col}")
             return
 
         fig = chart_func(
@@ -59,58 +100,63 @@ def render_distribution(
             title=title,
             **chart_kwargs,
         )
-        _show_chart(container, title, fig)
+        _emit(_pending, _show_chart, container, title, fig, _title_color)
         return
 
     # Pie/Bar/vbar paths
-    counts = custom_counts(df_all, df_present, col) if callable(custom_counts) else category_counts_present(
-        df_all,
-        df_present,
-        col,
-        drop_values=set(drop_values or []),
-        exclude_values=set(exclude_values or []),
-    )
+    if callable(custom_counts):
+        counts = custom_counts(df_all, df_present, col)
+    else:
+        counts = _counts(df_all, df_present, col, drop_values, exclude_values, _cache_key)
 
-    df_chart = make_count_df(counts)
-    if df_chart.empty or df_chart["Count"].sum() == 0:
-        with container:
-            st.warning(warn_text or f"No {title.lower()} data available.")
+    # empty check on the raw counts; only build the chart frame when there's something to draw
+    total = count_total(counts)
+    if total == 0:
+        _emit(_pending, _show_msg, container, st.warning, warn_text or f"No {title.lower()} data available.")
         return
+    df_chart = make_count_df(counts, total=total)
 
     # Horizontal bar: sort by Count desc (ranked view)
     if kind == "bar":
         df_chart = df_chart.sort_values("Count", ascending=False).reset_index(drop=True)
-        df_chart["Category"] = pd.Categorical(df_chart["Category"], categories=df_chart["Category"], ordered=True)
+        # df_chart is a local frame from here on, so labels can be added in place
         if bar_with_labels and "Label" not in df_chart:
-            df_chart = add_bar_labels(df_chart)
-        fig = chart_func(df_chart, "Category", "Count", df_chart.get("Label"), title)
-        _show_chart(container, title, fig)
+            df_chart = add_bar_labels(df_chart, copy=False)
+        # axis order goes to the builder; Category stays a plain string column
+        fig = chart_func(df_chart, "Category", "Count", df_chart.get("Label"), title,
+                         category_order=df_chart["Category"].tolist())
+        _emit(_pending, _show_chart, container, title, fig, _title_color)
         return
 
     # Vertical bar (vbar): preserve incoming order (great for months)
     if kind == "vbar":
-        # keep original order from counts; ensure categorical to lock axis order
+        # keep original order from counts; category_order locks the axis order
         df_chart = df_chart.reset_index(drop=True)
         cat_order = df_chart["Category"].tolist()
-        df_chart["Category"] = pd.Categorical(df_chart["Category"], categories=cat_order, ordered=True)
         # optional bar labels
         label_series = df_chart.get("Label")
         if bar_with_labels and label_series is None:
             # add_bar_labels works fine for vertical too; provides 'Label' column
-            df_chart = add_bar_labels(df_chart)
+            df_chart = add_bar_labels(df_chart, copy=False)
             label_series = df_chart.get("Label")
         # pass category_order via chart_kwargs (builder.vbar supports it)
         ck = {"category_order": cat_order, **chart_kwargs}
         fig = chart_func(df_chart, x="Category", y="Count", text=label_series if label_series is not None else "Count", title=title, **ck)
-        _show_chart(container, title, fig)
+        _emit(_pending, _show_chart, container, title, fig, _title_color)
         return
 
     # Default: pie
     fig = chart_func(df_chart, "Count", "Category", title)
-    _show_chart(container, title, fig)
+    _emit(_pending, _show_chart, container, title, fig, _title_color)
 
 # ---- render multiple charts ----
-def render_many(specs, df_all, df_present):
+def render_many(specs, df_all, df_present, cache_key=None):
+    # cache_key: optional hashable that fully determines df_all/df_present (e.g. data
+    # file + filter_signature); category counts are then cached across reruns
+    # df_all.empty folds into the set: an empty frame matches have_cols' "no columns"
+    cols_all = frozenset() if df_all is None or df_all.empty else frozenset(df_all.columns)
+    title_color = get_theme_text_color()
+    pending = []
     for s in specs:
         render_distribution(
             container=s["container"],
@@ -129,4 +175,34 @@ def render_many(specs, df_all, df_present):
             sex_col=s.get("sex_col"),
             normalize_category=s.get("normalize_category"),
             chart_kwargs=s.get("chart_kwargs"),
+            _cols_all=cols_all,
+            _title_color=title_color,
+            _pending=pending,
+            _cache_key=cache_key,
         )
+    for fn, args in pending:
+        fn(*args)
+
+# ---- several pies in one figure ----
+def render_pie_grid(container, specs, df_all, df_present, chart_func, *, title=None, cols=3, cache_key=None, warn_text=None):
+    """
+    Pies for specs [{"col", "title", "drop_values"?, "exclude_values"?}, ...] drawn by
+    chart_func (builder.pie_grid) as one figure / one st.plotly_chart. Columns that are
+    missing or empty keep their subplot slot, titled "(no data)"; cache_key: see render_many.
+    """
+    cols_all = frozenset() if df_all is None or df_all.empty else frozenset(df_all.columns)
+    items = []
+    for s in specs:
+        df_chart = None
+        if not df_present.empty and s["col"] in cols_all:
+            counts = _counts(df_all, df_present, s["col"], s.get("drop_values"), s.get("exclude_values"), cache_key)
+            total = count_total(counts)
+            if total:
+                df_chart = make_count_df(counts, total=total)
+        items.append((s["title"], df_chart))
+    if all(d is None for _, d in items):
+        _show_msg(container, st.warning, warn_text or "No data available.")
+        return
+    empty = make_count_df(None)
+    fig = chart_func([(t, d if d is not None else empty) for t, d in items], "Count", "Category", cols=cols)
+    _show_chart(container, title, fig)
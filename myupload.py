@@ -1,17 +1,45 @@
 #!/usr/bin/env python3
 import os
+import re
 import sys
 import argparse
-import mimetypes
+import hashlib
+import json
+import threading
 from pathlib import Path
-from typing import Iterable, List, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
+# Optional: stream multipart bodies from the open files instead of building them in memory
+try:
+    from requests_toolbelt import MultipartEncoder
+    HAS_TOOLBELT = True
+except Exception:
+    HAS_TOOLBELT = False
+
 ALLOWED_EXTS = {".xls", ".xlsx", ".xlsm", ".xlsb"}  # adjust if needed
 EXCEL_TEMP_PREFIX = "~$"  # Excel lock/temp files
+EXT_MIME = {
+    ".xls": "application/vnd.ms-excel",
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".xlsm": "application/vnd.ms-excel.sheet.macroEnabled.12",
+    ".xlsb": "application/vnd.ms-excel.sheet.binary.macroEnabled.12",
+}
+# one case-insensitive suffix test per filename, built from ALLOWED_EXTS (not a dotfile like ".xlsx")
+_ALLOWED_NAME = re.compile(r"(?<=.)(?:%s)\Z" % "|".join(map(re.escape, sorted(ALLOWED_EXTS))), re.IGNORECASE).search
+
+_print_lock = threading.Lock()
+
+def log(*args, **kwargs) -> None:
+    # batches upload on worker threads; keep each line whole
+    with _print_lock:
+        print(*args, **kwargs, flush=True)
 
 def human_bytes(n: int) -> str:
     for unit in ["B", "KB", "MB", "GB"]:
@@ -24,29 +52,125 @@ def validate_token(token: str) -> None:
     if not token or len(token) != 32:
         raise ValueError("UPLOAD_TOKEN must be exactly 32 characters.")
 
+def _iter_excel_entries(folder: Path) -> Iterable[os.DirEntry]:
+    # os.scandir walk: file/dir checks come from the directory entry itself,
+    # so no stat per entry and no Path objects for files that don't match
+    stack = [str(folder)]
+    while stack:
+        d = stack.pop()
+        try:
+            it = os.scandir(d)
+        except OSError:  # unreadable folder: skip it, like rglob
+            continue
+        with it:
+            for e in it:
+                if e.is_dir(follow_symlinks=False):
+                    stack.append(e.path)
+                    continue
+                name = e.name
+                if name.startswith(EXCEL_TEMP_PREFIX):
+                    continue
+                if _ALLOWED_NAME(name) is not None and e.is_file():
+                    yield e
+
 def iter_excel_files(folder: Path) -> Iterable[Path]:
-    for p in folder.rglob("*"):
-        if not p.is_file():
+    for e in _iter_excel_entries(folder):
+        yield Path(e.path)
+
+def scan_excel_files(folder: Path) -> Dict[Path, int]:
+    """
+    {path: size} for every Excel file under folder, sizes taken from the directory
+    entry (free on Windows, where scandir already carries them; one stat elsewhere).
+    """
+    sizes: Dict[Path, int] = {}
+    for e in _iter_excel_entries(folder):
+        try:
+            sizes[Path(e.path)] = e.stat().st_size
+        except OSError:  # vanished mid-walk
             continue
-        if p.name.startswith(EXCEL_TEMP_PREFIX):
+    return sizes
+
+def file_sizes(files: Iterable[Path]) -> Dict[Path, int]:
+    """Stat each file once; files that vanished since listing are left out."""
+    sizes: Dict[Path, int] = {}
+    for f in files:
+        try:
+            sizes[f] = f.stat().st_size
+        except FileNotFoundError:
             continue
-        if p.suffix.lower() in ALLOWED_EXTS:
-            yield p
+    return sizes
 
-def pack_batches_by_size(files: List[Path], max_batch_mb: float) -> List[List[Path]]:
+def sha256_file(p: Path) -> str:
+    with open(p, "rb") as fh:
+        if hasattr(hashlib, "file_digest"):  # Python 3.11+
+            return hashlib.file_digest(fh, "sha256").hexdigest()
+        h = hashlib.sha256()
+        for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+            h.update(chunk)
+        return h.hexdigest()
+
+def load_manifest(path: Path) -> dict:
+    """
+    Local upload record: {"files": {path: [size, mtime_ns, sha256]}, "uploaded": [[relpath, sha256], ...]}.
+    A missing or unreadable file starts a fresh record; old hash-only "uploaded" entries are dropped.
+    """
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        uploaded = [list(e) for e in data.get("uploaded", []) if isinstance(e, list) and len(e) == 2]
+        return {"files": dict(data.get("files", {})), "uploaded": uploaded}
+    except (OSError, ValueError, AttributeError):
+        return {"files": {}, "uploaded": []}
+
+def upload_key(folder: Path, p: Path, digest: str) -> Tuple[str, str]:
+    return p.relative_to(folder).as_posix(), digest
+
+def save_manifest(path: Path, manifest: dict) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(manifest), encoding="utf-8")
+    os.replace(tmp, path)
+
+def file_digests(files: List[Path], manifest: dict, workers: int = 4) -> Dict[Path, str]:
+    """
+    sha256 per file. Hashes of files whose size and mtime are unchanged come from
+    the manifest; the rest are hashed in a small thread pool (hashlib drops the GIL).
+    Updates manifest["files"] in place.
+    """
+    cached = manifest["files"]
+    digests: Dict[Path, str] = {}
+    todo: List[Tuple[Path, int, int]] = []
+    for p in files:
+        try:
+            st_ = p.stat()
+        except FileNotFoundError:
+            continue
+        hit = cached.get(str(p))
+        if hit and hit[0] == st_.st_size and hit[1] == st_.st_mtime_ns:
+            digests[p] = hit[2]
+        else:
+            todo.append((p, st_.st_size, st_.st_mtime_ns))
+    if todo:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for (p, size, mtime_ns), digest in zip(todo, pool.map(lambda t: sha256_file(t[0]), todo)):
+                digests[p] = digest
+                cached[str(p)] = [size, mtime_ns, digest]
+    return digests
+
+def pack_batches_by_size(files: List[Path], max_batch_mb: float, sizes: Optional[Dict[Path, int]] = None) -> List[List[Path]]:
     """
     Greedy packer to keep each request under a target size.
     This helps avoid 413 Request Entity Too Large on the server.
+    Pass sizes (see file_sizes) to skip the per-file stat.
     """
+    if sizes is None:
+        sizes = file_sizes(files)
     max_bytes = int(max_batch_mb * 1024 * 1024)
     batches: List[List[Path]] = []
     current: List[Path] = []
     current_size = 0
 
     for f in files:
-        try:
-            sz = f.stat().st_size
-        except FileNotFoundError:
+        sz = sizes.get(f)
+        if sz is None:
             continue
         # If a single file exceeds max, send it alone
         if sz > max_bytes:
@@ -70,6 +194,42 @@ def pack_batches_by_size(files: List[Path], max_batch_mb: float) -> List[List[Pa
         batches.append(current)
     return batches
 
+class RewindableEncoder:
+    """
+    MultipartEncoder wrapper that supports seek(0), so the adapter's Retry can
+    resend a streamed body. Rewinding rebuilds the encoder over the same
+    (reset) file handles with the same boundary.
+    """
+    def __init__(self, fields: list):
+        self._fields = fields
+        self._enc = MultipartEncoder(fields=fields)
+        self._pos = 0
+
+    @property
+    def content_type(self) -> str:
+        return self._enc.content_type
+
+    @property
+    def len(self) -> int:
+        return self._enc.len
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self._enc.read(size)
+        self._pos += len(chunk)
+        return chunk
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, pos: int, whence: int = 0) -> int:
+        if pos != 0 or whence != 0:
+            raise OSError("RewindableEncoder only supports seek(0)")
+        for _, (_, fh, _) in self._fields:
+            fh.seek(0)
+        self._enc = MultipartEncoder(fields=self._fields, boundary=self._enc.boundary_value)
+        self._pos = 0
+        return 0
+
 def post_batch(session: requests.Session, url: str, batch: List[Path], timeout: int) -> Tuple[bool, dict]:
     """
     Send one multipart request with multiple files field 'files'.
@@ -79,12 +239,16 @@ def post_batch(session: requests.Session, url: str, batch: List[Path], timeout:
     with ExitStack() as stack:
         files_payload = []
         for p in batch:
-            mime = mimetypes.guess_type(p.name)[0] or "application/octet-stream"
+            mime = EXT_MIME.get(p.suffix.lower(), "application/octet-stream")
             fh = stack.enter_context(open(p, "rb"))
             files_payload.append(("files", (p.name, fh, mime)))
 
         try:
-            resp = session.post(url, files=files_payload, timeout=timeout)
+            if HAS_TOOLBELT:
+                body = RewindableEncoder(files_payload)
+                resp = session.post(url, data=body, headers={"Content-Type": body.content_type}, timeout=timeout)
+            else:
+                resp = session.post(url, files=files_payload, timeout=timeout)
         except requests.RequestException as e:
             return False, {"error": f"request failed: {e}"}
 
@@ -93,9 +257,80 @@ def post_batch(session: requests.Session, url: str, batch: List[Path], timeout:
     except ValueError:
         data = {"error": f"non-JSON response", "status_code": resp.status_code, "text": resp.text[:500]}
 
-    ok = resp.ok and isinstance(data, dict) and data.get("status") in {"ok", "success"} or resp.status_code in (200, 201)
+    if not resp.ok:
+        ok = False
+    elif isinstance(data, dict) and "status" in data:
+        # a JSON status wins over the HTTP code (a 200 can still report a failure)
+        ok = data["status"] in {"ok", "success"}
+    else:
+        ok = resp.status_code in (200, 201)
+    if not ok and isinstance(data, dict):
+        data.setdefault("status_code", resp.status_code)
     return ok, data
 
+def _delivered(batch: List[Path], skipped: list) -> List[Path]:
+    # files the server accepted: everything it didn't list as skipped
+    names = {s.get("filename") for s in skipped if isinstance(s, dict)}
+    return [p for p in batch if p.name not in names]
+
+def _result_lists(data) -> Tuple[List[str], List[dict]]:
+    data = data if isinstance(data, dict) else {}
+    saved, skipped = data.get("saved", []), data.get("skipped", [])
+    return (saved if isinstance(saved, list) else []), (skipped if isinstance(skipped, list) else [])
+
+def _upload_files(session: requests.Session, url: str, label: str, files: List[Path], timeout: int) -> Tuple[List[str], List[dict], List[Path]]:
+    ok, data = post_batch(session, url, files, timeout=timeout)
+    if ok:
+        saved, skipped = _result_lists(data)
+        log(f"[OK] {label} → saved={len(saved)} skipped={len(skipped)}")
+        return saved, skipped, _delivered(files, skipped)
+
+    log(f"[ERROR] {label} failed: {data}", file=sys.stderr)
+    saved_out: List[str] = []
+    skipped_out: List[dict] = []
+    delivered: List[Path] = []
+
+    if len(files) > 1 and isinstance(data, dict) and data.get("status_code") == 413:
+        # too large: halve and try again, keeping the packer's multi-file requests
+        mid = len(files) // 2
+        log(f"[SPLIT] {label} too large, retrying as {mid} + {len(files) - mid} files …")
+        for part_label, part in ((f"{label}a", files[:mid]), (f"{label}b", files[mid:])):
+            saved, skipped, done = _upload_files(session, url, part_label, part, timeout)
+            saved_out.extend(saved)
+            skipped_out.extend(skipped)
+            delivered.extend(done)
+        return saved_out, skipped_out, delivered
+
+    if len(files) == 1:
+        # a lone file was just tried; resending it as-is won't help
+        p = files[0]
+        log(f"  ✗ {p.name} failed: {data}", file=sys.stderr)
+        return saved_out, [{"filename": p.name, "reason": str(data)}], delivered
+
+    # Fall back to one-by-one uploads for this batch
+    log(f"[RETRY] Sending files one-by-one for {label} …")
+    for p in files:
+        ok1, data1 = post_batch(session, url, [p], timeout=timeout)
+        if ok1:
+            saved, skipped = _result_lists(data1)
+            saved_out.extend(saved)
+            skipped_out.extend(skipped)
+            delivered.extend(_delivered([p], skipped))
+            log(f"  ✓ {p.name} uploaded")
+        else:
+            log(f"  ✗ {p.name} failed: {data1}", file=sys.stderr)
+            skipped_out.append({"filename": p.name, "reason": str(data1)})
+    return saved_out, skipped_out, delivered
+
+def upload_batch(session: requests.Session, url: str, i: int, n: int, batch: List[Path], timeout: int) -> Tuple[List[str], List[dict], List[Path]]:
+    """
+    Upload one batch. On a 413 the batch is split in half and retried; other
+    failures fall back to one-by-one uploads.
+    Returns (saved, skipped, delivered local paths) for this batch.
+    """
+    log(f"[UPLOAD] Batch {i}/{n} …")
+    return _upload_files(session, url, f"Batch {i}", batch, timeout)
+
 def main():
     load_dotenv()
 
@@ -105,6 +340,10 @@ def main():
     parser.add_argument("--token", default=os.getenv("UPLOAD_TOKEN", ""), help="32-char upload token")
     parser.add_argument("--max-batch-mb", type=float, default=float(os.getenv("MAX_BATCH_MB", "40")), help="Target max size (MB) per request")
     parser.add_argument("--timeout", type=int, default=int(os.getenv("REQUEST_TIMEOUT", "300")), help="Request timeout (seconds)")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("UPLOAD_CONCURRENCY", "4")), help="Batches uploaded in parallel")
+    parser.add_argument("--skip-uploaded", action="store_true", default=os.getenv("SKIP_UPLOADED", "").strip().lower() in {"1", "true", "yes"},
+                        help="Skip files this machine already uploaded with the same relative path and sha256 (see --manifest)")
+    parser.add_argument("--manifest", default=os.getenv("UPLOAD_MANIFEST", ".upload_cache.json"), help="Local hash/upload record used by --skip-uploaded")
     parser.add_argument("--dry-run", action="store_true", help="List files and planned batches without uploading")
     args = parser.parse_args()
 
@@ -119,65 +358,79 @@ def main():
         print(f"[ERROR] Folder not found: {folder}", file=sys.stderr)
         sys.exit(2)
 
-    files = sorted(iter_excel_files(folder))
+    sizes = scan_excel_files(folder)  # the only size lookup: planning and reports reuse it
+    files = sorted(sizes)
     if not files:
         print(f"[INFO] No Excel files found under: {folder}")
         return
 
+    manifest_path = Path(args.manifest)
+    manifest = digests = uploaded = None
+    if args.skip_uploaded:
+        manifest = load_manifest(manifest_path)
+        digests = file_digests(files, manifest, workers=args.concurrency)
+        # keyed on (relative path, content): a renamed or moved copy is still sent
+        uploaded = {tuple(e) for e in manifest["uploaded"]}
+        pending = [p for p in files if p in digests and upload_key(folder, p, digests[p]) not in uploaded]
+        print(f"[INFO] {len(files) - len(pending)} file(s) already uploaded (same path and sha256), skipping")
+        files = pending
+        save_manifest(manifest_path, manifest)  # keep the hashes even if nothing is sent
+        if not files:
+            print("[INFO] Nothing new to upload.")
+            return
+
     # Build upload URL: /upload/{token}
     url = f"{args.url.rstrip('/')}/upload/{args.token}"
     print(f"[INFO] Upload URL: {url}")
     print(f"[INFO] Found {len(files)} files in {folder}")
 
     # Pack batches by size to avoid 413s
-    batches = pack_batches_by_size(files, args.max_batch_mb)
-    total_bytes = sum(p.stat().st_size for p in files if p.exists())
+    batches = pack_batches_by_size(files, args.max_batch_mb, sizes)
+    total_bytes = sum(sizes[p] for p in files)
     print(f"[INFO] Total size: {human_bytes(total_bytes)} across {len(batches)} batch(es) (target {args.max_batch_mb} MB per batch)")
 
     for i, batch in enumerate(batches, 1):
-        batch_bytes = sum(p.stat().st_size for p in batch if p.exists())
+        batch_bytes = sum(sizes[p] for p in batch)
         print(f"  - Batch {i}: {len(batch)} files, {human_bytes(batch_bytes)}")
 
     if args.dry_run:
         print("[DRY RUN] No uploads performed.")
         return
 
-    # Upload
+    # Upload: batches are independent, so send several at once over one session
+    workers = max(1, min(args.concurrency, len(batches)))
     session = requests.Session()
+    # transient gateway/throttling errors are retried on the same pooled connection
+    # before upload_batch falls back to one-by-one sends
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=frozenset({"POST"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
     all_saved: List[str] = []
     all_skipped: List[dict] = []
 
-    for i, batch in enumerate(batches, 1):
-        print(f"[UPLOAD] Batch {i}/{len(batches)} …")
-        ok, data = post_batch(session, url, batch, timeout=args.timeout)
-
-        if not ok:
-            print(f"[ERROR] Batch {i} failed: {data}", file=sys.stderr)
-            # Fall back to one-by-one uploads for this batch
-            print(f"[RETRY] Sending files one-by-one for batch {i} …")
-            for p in batch:
-                ok1, data1 = post_batch(session, url, [p], timeout=args.timeout)
-                if ok1:
-                    saved = data1.get("saved", [])
-                    all_saved.extend(saved if isinstance(saved, list) else [])
-                    skipped = data1.get("skipped", [])
-                    if isinstance(skipped, list):
-                        all_skipped.extend(skipped)
-                    print(f"  ✓ {p.name} uploaded")
-                else:
-                    print(f"  ✗ {p.name} failed: {data1}", file=sys.stderr)
-                    all_skipped.append({"filename": p.name, "reason": str(data1)})
-            continue
-
-        # Aggregate results
-        saved = data.get("saved", [])
-        skipped = data.get("skipped", [])
-        if isinstance(saved, list):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(upload_batch, session, url, i, len(batches), batch, args.timeout)
+            for i, batch in enumerate(batches, 1)
+        ]
+        # results are collected here on the main thread, so no lock is needed
+        for fut in as_completed(futures):
+            saved, skipped, delivered = fut.result()
             all_saved.extend(saved)
-        if isinstance(skipped, list):
             all_skipped.extend(skipped)
+            if uploaded is not None:
+                uploaded.update(upload_key(folder, p, digests[p]) for p in delivered)
 
-        print(f"[OK] Batch {i} → saved={len(saved)} skipped={len(skipped)}")
+    if manifest is not None:
+        manifest["uploaded"] = [list(k) for k in sorted(uploaded)]
+        save_manifest(manifest_path, manifest)
 
     print("\n===== SUMMARY =====")
     print(f"Uploaded (saved): {len(all_saved)}")
@@ -1,14 +1,14 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 from common.Chart_builder import builder
-from common.helper import is_done, metric_card, inject_global_dataframe_css, render_metric_cards
+from common.helper import is_done_series, metric_card, to_datetime_safe, render_metric_cards, section
 from common.render import render_many
 from common import config
-from common.dynamic_sidebar import dynamic_sidebar_filters
+from common.dynamic_sidebar import dynamic_sidebar_filters, filter_signature
 
 # Page setup
 config.setup_page(page_title="📊 Cataract Management", page_key="cataract_management")
-inject_global_dataframe_css()
 DATA_PATH, SHEET = config.get_data_path("CataractData.xlsx", sheet=0)
 
 # Column registry
@@ -37,6 +37,8 @@ f, selected_filters = dynamic_sidebar_filters(df, RES, filters)
 if f.empty:
     st.warning("No data available with current filters.")
     st.stop()
+# f is fully determined by the data file and the filter values; cached page tables key on this
+F_SIG = (str(DATA_PATH), SHEET, DATA_PATH.stat().st_mtime, filter_signature(filters))
 
 # Header
 config.render_page_header(
@@ -47,23 +49,53 @@ config.render_page_header(
     show_filters_heading=True,
 )
 
+# is_done masks over f, built once and shared by the cards, tables and trend
+DONE = {
+    c: is_done_series(f[c])
+    for c in {RES.get(k) for k in ("cataractsx", "followdone", "bcvaf618", "bilateral")}
+    if c and c in f.columns
+}
+
+def done_mask(d: pd.DataFrame, col: str) -> pd.Series:
+    return DONE[col] if d is f and col in DONE else is_done_series(d[col])
+
 def count_done(col):
-    return f[col].apply(is_done).sum() if col in f.columns else 0
+    return int(done_mask(f, col).sum()) if col in f.columns else 0
+
+def _labels(s: pd.Series) -> pd.Series:
+    # fillna("Unknown").astype(str).str.strip(), done once per distinct value and gathered by code
+    codes, uniques = pd.factorize(s)
+    labels = np.append(pd.Index(uniques).astype(str).str.strip().to_numpy(dtype=object), "Unknown")
+    return pd.Series(labels[codes], index=s.index, name=s.name)
+
+def _mf_table(cl: pd.Series, sx: pd.Series, cluster: str) -> pd.DataFrame:
+    if cl.empty: return pd.DataFrame()
+    t = pd.crosstab(cl, sx)
+    cnt = t.to_numpy()
+    total = cnt.sum(axis=1)
+    pct = (cnt / total[:, None] * 100).round(1)
+    # "n (p%)" for every cell in one pass of numpy string kernels
+    cells = np.char.add(np.char.add(cnt.astype(str), " ("), np.char.add(pct.astype(str), "%)"))
+    t = pd.DataFrame(cells.astype(object), index=t.index, columns=t.columns)
+    t["Total"] = total
+    return t.reset_index().rename(columns={cluster: "Vision Centre"})
 
-def mf_table(col_name: str) -> pd.DataFrame:
+@st.cache_data(show_spinner=False, max_entries=32)
+def _mf_tables(sig, col_names: tuple, cluster: str, sex: str, _d: pd.DataFrame, _masks: tuple) -> list:
+    # sig stands in for the (unhashed) frame and masks.
+    # Cluster/sex labels are normalized once and shared by every table; each table
+    # then only gathers its done rows (no full-frame copy).
+    cl = _labels(_d[cluster])
+    sx = _labels(_d[sex])
+    return [_mf_table(cl[m], sx[m], cluster) if m is not None else pd.DataFrame() for m in _masks]
+
+def mf_tables(*col_names: str) -> list:
+    """One M/F-by-Vision-Centre table per done column, in order (empty frame if unavailable)."""
     cluster, sex = RES.get("cluster"), RES.get("sex")
-    if col_name not in f.columns or not cluster or not sex or cluster not in f.columns or sex not in f.columns:
-        return pd.DataFrame()
-    d = f.copy()
-    d[cluster] = d[cluster].fillna("Unknown").astype(str).str.strip()
-    d[sex] = d[sex].fillna("Unknown").astype(str).str.strip()
-    d = d[d[col_name].apply(is_done)]
-    if d.empty: return pd.DataFrame()
-    t = pd.crosstab(d[cluster], d[sex])
-    t["Total"] = t.sum(axis=1)
-    for s in t.columns[:-1]:
-        t[s] = t[s].astype(str) + " (" + (t[s] / t["Total"] * 100).round(1).astype(str) + "%)"
-    return t.reset_index().rename(columns={cluster: "Vision Centre"})
+    if not cluster or not sex or cluster not in f.columns or sex not in f.columns:
+        return [pd.DataFrame() for _ in col_names]
+    masks = tuple(done_mask(f, c) if c in f.columns else None for c in col_names)
+    return _mf_tables(F_SIG, col_names, cluster, sex, f, masks)
 
 metrics = {
     "🩺 Surgery Done": ("cataractsx", None),
@@ -72,26 +104,35 @@ metrics = {
     "👁️ Visual Acuity in Operated Eye ≥ 6/18": ("bcvaf618", "followdone"),
 }
 
-st.markdown("---")
-st.subheader("📌 Key Metrics")
-render_metric_cards(metrics, df=f, res=RES)  # optional: columns=st.columns(len(metrics))
+section("📌 Key Metrics")
+render_metric_cards(metrics, df=f, res=RES, done_masks=DONE)  # optional: columns=st.columns(len(metrics))
 
 
 # Monthly Surgery Trend (vbar via render_many)
-st.markdown("---")
-st.subheader("📊 Monthly Surgery Trend")
+section("📊 Monthly Surgery Trend")
+
+def _monthly_counts(d: pd.DataFrame, date_col: str, mask: pd.Series) -> pd.Series:
+    # load_df_or_stop already parsed the date column; to_datetime_safe passes it through
+    dates = to_datetime_safe(d[date_col][mask])
+    if dates.empty:
+        return pd.Series(dtype="int64")
+    # month buckets straight off the datetime64 values: no PeriodArray round trip
+    months = dates.to_numpy(dtype="datetime64[ns]").astype("datetime64[M]")
+    uniq, cnt = np.unique(months[~np.isnat(months)], return_counts=True)  # sorted by month
+    return pd.Series(cnt, index=pd.Index(np.datetime_as_string(uniq, unit="M"), name=date_col), name="count")  # 'YYYY-MM'
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _cached_monthly_counts(sig, date_col: str, _d: pd.DataFrame, _mask: pd.Series) -> pd.Series:
+    # sig stands in for the (unhashed) frame and mask
+    return _monthly_counts(_d, date_col, _mask)
 
 def _monthly_surgery_counts(df_all: pd.DataFrame, df_present: pd.DataFrame, date_col: str):
     sx_col = RES.get("cataractsx")
     if df_present.empty or not date_col or date_col not in df_present.columns or not sx_col or sx_col not in df_present.columns:
         return pd.Series(dtype="int64")
-    d = df_present[df_present[sx_col].apply(is_done)].copy()
-    if d.empty:
-        return pd.Series(dtype="int64")
-    m = pd.to_datetime(d[date_col], errors="coerce").dt.to_period("M")
-    grp = m.value_counts().sort_index()
-    grp.index = grp.index.astype(str)  # 'YYYY-MM'
-    return grp
+    if df_present is not f:  # F_SIG only describes f
+        return _monthly_counts(df_present, date_col, done_mask(df_present, sx_col))
+    return _cached_monthly_counts(F_SIG, date_col, f, done_mask(f, sx_col))
 
 trend_col = st.columns(1)[0]
 render_many([{
@@ -107,8 +148,7 @@ render_many([{
 }], df_all=f, df_present=f)
 
 # Surgery Technique & IOL
-st.markdown("---")
-st.subheader("📋 Surgery Technique & IOL Distribution")
+section("📋 Surgery Technique & IOL Distribution")
 
 c1, c2 = st.columns(2)
 render_many([
@@ -116,12 +156,11 @@ render_many([
      "chart_func": builder.pie, "drop_values": {"", "nan", "none", None, " "}},
     {"container": c2, "col": RES.get("iol"), "title": "IOL Distribution",
      "chart_func": builder.pie, "drop_values": {"", "nan", "none", None, " "}},
-], f, f)
+], f, f, cache_key=F_SIG)
 
 # Tables
 c1, c2 = st.columns(2)
-surgery_df = mf_table("cataractsx")
-follow_df = mf_table("followdone")
+surgery_df, follow_df = mf_tables("cataractsx", "followdone")
 
 with c1:
     st.markdown("### 🛠️ Surgeries Done (M/F)")
@@ -138,7 +177,4 @@ with c2:
     )
 
 # Footer
-st.markdown(
-    "<div class='caption'>✨ Use the <b>Clear</b> button in the sidebar to reset filters.</div>",
-    unsafe_allow_html=True
-)
+st.html("<div class='caption'>✨ Use the <b>Clear</b> button in the sidebar to reset filters.</div>")
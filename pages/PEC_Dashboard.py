@@ -1,15 +1,15 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 
 from common.Chart_builder import builder
-from common.helper import inject_global_dataframe_css, render_metric_cards
-from common.render import render_many
+from common.helper import render_metric_cards, text_isin, section
+from common.render import render_many, render_pie_grid
 from common import config
-from common.dynamic_sidebar import dynamic_sidebar_filters
+from common.dynamic_sidebar import dynamic_sidebar_filters, filter_signature
 
 # ========== Setup ==========
 config.setup_page(page_title="📊 Primary Eye Care", page_key="primary_eye_care")
-inject_global_dataframe_css()
 DATA_PATH, SHEET = config.get_data_path("PECdata.xlsx", sheet=0)
 
 # ========== Column registry ==========
@@ -42,79 +42,106 @@ CANDIDATES = {
 df, RES = config.load_df_or_stop(DATA_PATH, SHEET, candidates=CANDIDATES, date_key="date")
 
 # ========== Small helpers ==========
-YES = {"y", "yes", "true", "t", "1", "present", "referred", "done", "given", "issued", "booked"}
+YES = frozenset({"y", "yes", "true", "t", "1", "present", "referred", "done", "given", "issued", "booked"})
 UNIFORM_H = 260
 TABLE_HEIGHT = 260
+FOOTER_HTML = "<div class='caption'>✨ Use the <b>Clear</b> button in the sidebar to reset filters.</div>"
 sex_col = RES.get("sex")
 
-def col_ok(key: str):
-    c = RES.get(key)
-    return c if (c in df.columns) else None
+# resolved column per registry key (None if absent), looked up once instead of per use
+COLS = {k: (RES.get(k) if RES.get(k) in df.columns else None) for k in CANDIDATES}
 
 def yes_like(s: pd.Series) -> pd.Series:
     if s is None: return pd.Series([], dtype=bool)
-    return s.astype(str).str.strip().str.lower().isin(YES)
+    return text_isin(s, YES)
+
+SEX_LABELS = {
+    "m": "Male","male": "Male","man": "Male","boy": "Male",
+    "f": "Female","female": "Female","woman": "Female","girl": "Female",
+}
 
 def normalize_sex(s: pd.Series) -> pd.Series:
     if s is None: return pd.Series([], dtype="string")
-    z = s.astype("string").str.strip().str.lower().replace({
-        "m": "male","male": "male","man": "male","boy": "male",
-        "f": "female","female": "female","woman": "female","girl": "female",
-    })
-    return z.map({"male": "Male","female": "Female"})
+    # one dict lookup per distinct value, gathered back by code (NA / unknown -> NaN)
+    codes, uniques = pd.factorize(s)
+    labels = np.array([SEX_LABELS.get(str(u).strip().lower(), np.nan) for u in uniques] + [np.nan], dtype=object)
+    return pd.Series(labels[codes], index=s.index, name=s.name)
+
+def title_labels(s: pd.Series) -> pd.Series:
+    """s.astype("string").str.strip().str.title(), computed on the distinct values only."""
+    codes, uniques = pd.factorize(s)
+    labels = np.array([str(u).strip().title() for u in uniques] + [np.nan], dtype=object)
+    return pd.Series(labels[codes], index=s.index, name=s.name)
 
 def rm(charts, data):
     cleaned = [c for c in charts if c.get("col")]
-    if cleaned: render_many(cleaned, data, data)
+    # counts for F are cached across reruns under its filter signature (F_SIG, set below)
+    if cleaned: render_many(cleaned, data, data, cache_key=F_SIG if data is F else None)
 
-def mf_table(df_in: pd.DataFrame, by: str, label: str, order=None, mask=None) -> pd.DataFrame:
+def mf_table(df_in: pd.DataFrame, by: str, label: str, order=None, mask=None, sex=None) -> pd.DataFrame:
     cols = [label, "Male", "Female", "Total"]
     if df_in.empty or not by or by not in df_in.columns or sex_col not in df_in.columns:
         return pd.DataFrame(columns=cols)
-    d = (df_in.loc[mask] if mask is not None else df_in).copy()
-    if d.empty: return pd.DataFrame(columns=cols)
-    d["_sex"] = normalize_sex(d[sex_col]).dropna()
-    if d["_sex"].empty:
-        base = order or sorted(d[by].dropna().unique())
-        return pd.DataFrame({label: base, "Male": 0, "Female": 0, "Total": 0})
-    row_order = order or sorted(d[by].dropna().unique())
-    ct = pd.crosstab(d[by], d["_sex"]).reindex(columns=["Male","Female"], fill_value=0)
-    ct = ct.reindex(pd.Index(row_order, name=by), fill_value=0)
-    ct["Total"] = ct.sum(axis=1)
+    # only the two columns involved are sliced; sex may come pre-normalized over df_in's rows
+    keys = df_in[by]
+    sx = normalize_sex(df_in[sex_col]) if sex is None else sex
+    if mask is not None:
+        keys, sx = keys[mask], sx[mask]
+    if keys.empty: return pd.DataFrame(columns=cols)
+    # Male/Female counts per key via one bincount over packed (key code, is_female) pairs;
+    # sort=True hands back the distinct keys already in default row order
+    codes, uniques = pd.factorize(keys, sort=True)
+    row_order = order or list(uniques)
+    s_arr = sx.to_numpy(dtype=object)
+    is_f = s_arr == "Female"
+    keep = (codes >= 0) & (is_f | (s_arr == "Male"))
+    counts = np.bincount(codes[keep] * 2 + is_f[keep], minlength=2 * len(uniques)).reshape(-1, 2)
+    if order:
+        # rows onto the requested order with one positional gather (absent keys -> zero row)
+        pos = pd.Index(uniques).get_indexer(order)
+        counts = np.vstack([counts, np.zeros((1, 2), dtype=counts.dtype)])[pos]
+    ct = pd.DataFrame(counts, index=pd.Index(row_order, name=by), columns=["Male","Female"])
+    ct["Total"] = counts.sum(axis=1)
     return ct.reset_index().rename(columns={by: label})
 
+def sorted_unique(s: pd.Series) -> list:
+    """Distinct non-null values in ascending order (sorted in C, not via Python's sorted)."""
+    return np.sort(pd.unique(s.dropna().to_numpy())).tolist()
+
 def add_row_pct_compact(df_tbl: pd.DataFrame, label_col: str) -> pd.DataFrame:
     need = {label_col, "Male", "Female", "Total"}
     if df_tbl.empty or not need.issubset(df_tbl.columns): return df_tbl
     out = df_tbl.copy()
-    denom = out["Total"].replace(0, pd.NA)
-    male_pct = (out["Male"] / denom * 100).round(1).fillna(0)
-    female_pct = (out["Female"] / denom * 100).round(1).fillna(0)
-    male_cnt_str = out["Male"].astype("Int64").map(lambda v: f"{v:,}" if pd.notna(v) else "0")
-    female_cnt_str = out["Female"].astype("Int64").map(lambda v: f"{v:,}" if pd.notna(v) else "0")
-    out["Male"] = male_cnt_str + " (" + male_pct.map(lambda x: f"{x:.1f}%") + ")"
-    out["Female"] = female_cnt_str + " (" + female_pct.map(lambda x: f"{x:.1f}%") + ")"
+    # row percents on float ndarrays (zero Total -> 0%), not through a pd.NA object column
+    total = out["Total"].to_numpy(dtype=float)
+    nz = total != 0
+    # one f-string per cell over plain lists: no per-element pandas dispatch
+    for c in ("Male", "Female"):
+        cnt = out[c].astype("Int64").fillna(0)
+        pct = (np.divide(cnt.to_numpy(dtype=float), total, out=np.zeros_like(total), where=nz) * 100).round(1)
+        out[c] = [f"{n:,} ({p:.1f}%)" for n, p in zip(cnt.tolist(), pct.tolist())]
     return out[[c for c in [label_col, "Male", "Female", "Total"] if c in out.columns]]
 
+BLANK_LABELS = frozenset(("", "nan", "none"))
+TAIL_LABELS = BLANK_LABELS | {"other"}
+
 def clean_label_rows(df_tbl: pd.DataFrame, label_col: str) -> pd.DataFrame:
     if df_tbl.empty or label_col not in df_tbl.columns: return df_tbl
-    bad = df_tbl[label_col].astype(str).str.strip().str.lower().isin(("", "nan", "none"))
-    return df_tbl.loc[~bad].copy()
+    return df_tbl.loc[~text_isin(df_tbl[label_col], BLANK_LABELS)].copy()
 
 def is_tail_label(s: pd.Series) -> pd.Series:
-    t = s.astype(str).str.strip().str.lower()
-    return t.isin(("", "nan", "none", "other"))
+    return text_isin(s, TAIL_LABELS)
 
 # ========== Filters & Header ==========
-F, selected = dynamic_sidebar_filters(
-    df, RES,
-    [
-        {"col": "date", "label": "📅 Date", "type": "date"},
-        {"col": "pec", "label": "🏥 Team", "type": "multiselect"},
-        {"col": "cluster", "label": "🧩 Vision Centre", "type": "multiselect"},
-        {"col": "sex", "label": "👦👧 Sex", "type": "multiselect"},
-    ],
-)
+FILTERS = [
+    {"col": "date", "label": "📅 Date", "type": "date"},
+    {"col": "pec", "label": "🏥 Team", "type": "multiselect"},
+    {"col": "cluster", "label": "🧩 Vision Centre", "type": "multiselect"},
+    {"col": "sex", "label": "👦👧 Sex", "type": "multiselect"},
+]
+F, selected = dynamic_sidebar_filters(df, RES, FILTERS)
+# F is fully determined by the data file and the filter values; cached derived columns key on this
+F_SIG = (str(DATA_PATH), SHEET, DATA_PATH.stat().st_mtime, filter_signature(FILTERS))
 config.render_page_header(
     title="📊 Primary Eye Care Program",
     data_path=DATA_PATH,
@@ -130,24 +157,25 @@ metrics = {
     "📘 Spectacles Dispensed": ("specbook", "specpres"),
     "➡️ Referred Patients": ("referred", "date"),
 }
-st.markdown("---")
-st.subheader("📌 Key Metrics")
+section("📌 Key Metrics")
 render_metric_cards(metrics, df=F, res=RES)
 
 # ========== Demographics ==========
-st.markdown("---")
-st.subheader("👨‍👩‍👧 Demographics Screening")
+section("👨‍👩‍👧 Demographics Screening")
 
+# Nothing below has anything to show for zero rows: skip the charts and all six tables
 if F.empty:
     st.info("No data to display with the current filters.")
-else:
-    d1, d2, d3, d4 = st.columns(4)
-    rm([
-        dict(container=d1, col=col_ok("sex"),           title="Gender Distribution",        chart_func=builder.pie, drop_values={"","nan"}),
-        dict(container=d2, col=col_ok("agewisesexcat"), title="Age & Gender Distribution",  chart_func=builder.pie, drop_values={"","nan"}),
-        dict(container=d3, col=col_ok("betterpvacat"),  title="Vision Assessment",          chart_func=builder.pie, drop_values={"","nan"}),
-        dict(container=d4, col=col_ok("need"),          title="Spectacle Need",             chart_func=builder.pie, drop_values={"","nan"}),
-    ], F)
+    st.html(FOOTER_HTML)
+    st.stop()
+
+d1, d2, d3, d4 = st.columns(4)
+rm([
+    dict(container=d1, col=COLS["sex"],           title="Gender Distribution",        chart_func=builder.pie, drop_values={"","nan"}),
+    dict(container=d2, col=COLS["agewisesexcat"], title="Age & Gender Distribution",  chart_func=builder.pie, drop_values={"","nan"}),
+    dict(container=d3, col=COLS["betterpvacat"],  title="Vision Assessment",          chart_func=builder.pie, drop_values={"","nan"}),
+    dict(container=d4, col=COLS["need"],          title="Spectacle Need",             chart_func=builder.pie, drop_values={"","nan"}),
+], F)
 
 # ========== New/Old × Sex and Wear Glass × Sex ==========
 d5, d6 = st.columns(2)
@@ -170,7 +198,7 @@ second_row_specs = [
         "title": "Wear Glass by Gender",
         "kind": "grouped_sex",
         "chart_func": builder.grouped_by_category_and_sex,
-        "normalize_category": lambda s: s.astype("string").str.strip().str.title(),
+        "normalize_category": title_labels,
         "chart_kwargs": {"height": UNIFORM_H, "category_order": None, "sex_order": ("Male","Female")},
         "info_text": "Wear Glass by Gender not available.",
     },
@@ -178,86 +206,83 @@ second_row_specs = [
 render_many(second_row_specs, df_all=F, df_present=F)
 
 # ========== Refraction & Spectacles ==========
-st.markdown("---")
-st.subheader("👓 Refraction & Spectacles Detail")
-
-if not F.empty:
-    c1, c2, c3, c4 = st.columns(4)
-    rm([
-        dict(container=c1, col=col_ok("dry_pmt_dil"),    title="Refraction Type",             chart_func=builder.pie, drop_values={"","nan"}),
-        dict(container=c2, col=col_ok("spec_pres"),      title="Spectacles Prescribed",       chart_func=builder.pie, drop_values={"","nan"}),
-        dict(container=c3, col=col_ok("spec_pres_type"), title="Prescribed Spectacles Type",  chart_func=builder.pie, drop_values={"","nan"}),
-        dict(container=c4, col=col_ok("specprice"),      title="Dispensed Spectacles",        chart_func=builder.pie, drop_values={"","nan"}),
-    ], F)
+section("👓 Refraction & Spectacles Detail")
+
+c1, c2, c3, c4 = st.columns(4)
+rm([
+    dict(container=c1, col=COLS["dry_pmt_dil"],    title="Refraction Type",             chart_func=builder.pie, drop_values={"","nan"}),
+    dict(container=c2, col=COLS["spec_pres"],      title="Spectacles Prescribed",       chart_func=builder.pie, drop_values={"","nan"}),
+    dict(container=c3, col=COLS["spec_pres_type"], title="Prescribed Spectacles Type",  chart_func=builder.pie, drop_values={"","nan"}),
+    dict(container=c4, col=COLS["specprice"],      title="Dispensed Spectacles",        chart_func=builder.pie, drop_values={"","nan"}),
+], F)
 
 # ========== WGSS ==========
-st.markdown("---")
-st.subheader("🧍 Washington Group Short Set (WGSS)")
-
-if not F.empty:
-    r1c1, r1c2, r1c3 = st.columns(3)
-    rm([
-        dict(container=r1c1, col=col_ok("vision"),  title="Vision",       chart_func=builder.pie, drop_values={"","nan"}),
-        dict(container=r1c2, col=col_ok("hearing"), title="Hearing",      chart_func=builder.pie, drop_values={"","nan"}),
-        dict(container=r1c3, col=col_ok("walking"), title="Walking",      chart_func=builder.pie, drop_values={"","nan"}),
-    ], F)
-
-    r2c1, r2c2, r2c3 = st.columns(3)
-    rm([
-        dict(container=r2c1, col=col_ok("remember"),      title="Remembering",   chart_func=builder.pie, drop_values={"","nan"}),
-        dict(container=r2c2, col=col_ok("selfcare"),      title="Self Care",     chart_func=builder.pie, drop_values={"","nan"}),
-        dict(container=r2c3, col=col_ok("communication"), title="Communication", chart_func=builder.pie, drop_values={"","nan"}),
-    ], F)
+section("🧍 Washington Group Short Set (WGSS)")
+
+# the six domains share one answer scale, so they go out as a single 2x3 figure with one legend
+render_pie_grid(st.container(), [
+    dict(col=COLS["vision"],        title="Vision",        drop_values={"","nan"}),
+    dict(col=COLS["hearing"],       title="Hearing",       drop_values={"","nan"}),
+    dict(col=COLS["walking"],       title="Walking",       drop_values={"","nan"}),
+    dict(col=COLS["remember"],      title="Remembering",   drop_values={"","nan"}),
+    dict(col=COLS["selfcare"],      title="Self Care",     drop_values={"","nan"}),
+    dict(col=COLS["communication"], title="Communication", drop_values={"","nan"}),
+], F, F, builder.pie_grid, cols=3, cache_key=F_SIG, warn_text="No WGSS data available.")
 
 # ========== Clinical ==========
-st.markdown("---")
-st.subheader("🩺 Clinical Examination")
-
-if not F.empty:
-    a, b = st.columns([3, 1])
-    rm([
-        dict(container=a, col=col_ok("diagnosis_code"), title="Screen Patients Diagnosis",
-             chart_func=builder.bar, kind="bar", bar_with_labels=True, drop_values={"","nan"}),
-        dict(container=b, col=col_ok("referred"),       title="Referred Patients",
-             chart_func=builder.pie, drop_values={"","nan"}),
-    ], F)
-
-    c, d = st.columns(2)
-    rm([
-        dict(container=c, col=col_ok("ref_dig"), title="Referred Patients Diagnosis",
-             chart_func=builder.bar, kind="bar", bar_with_labels=True, drop_values={"","nan"}),
-        dict(container=d, col=col_ok("clinic"),  title="Referred Clinic",
-             chart_func=builder.bar, kind="bar", bar_with_labels=True, drop_values={"","nan"}),
-    ], F)
+section("🩺 Clinical Examination")
+
+a, b = st.columns([3, 1])
+rm([
+    dict(container=a, col=COLS["diagnosis_code"], title="Screen Patients Diagnosis",
+         chart_func=builder.bar, kind="bar", bar_with_labels=True, drop_values={"","nan"}),
+    dict(container=b, col=COLS["referred"],       title="Referred Patients",
+         chart_func=builder.pie, drop_values={"","nan"}),
+], F)
+
+c, d = st.columns(2)
+rm([
+    dict(container=c, col=COLS["ref_dig"], title="Referred Patients Diagnosis",
+         chart_func=builder.bar, kind="bar", bar_with_labels=True, drop_values={"","nan"}),
+    dict(container=d, col=COLS["clinic"],  title="Referred Clinic",
+         chart_func=builder.bar, kind="bar", bar_with_labels=True, drop_values={"","nan"}),
+], F)
 
 # ========== Sex-wise Tables ==========
-st.markdown("---")
-st.subheader("📋 Sex-wise Tables")
+section("📋 Sex-wise Tables")
+
+pec_c, clus_c, ref_c = COLS["pec"], COLS["cluster"], COLS["referred"]
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _derived(sig, sex: str, ref: str, _F: pd.DataFrame):
+    # sig stands in for the (unhashed) frame; shared by every sex-wise table below
+    sex_norm = normalize_sex(_F[sex]) if sex in _F.columns else None
+    ref_mask = yes_like(_F[ref]) if ref else None
+    return sex_norm, ref_mask
 
-pec_c, clus_c, ref_c = col_ok("pec"), col_ok("cluster"), col_ok("referred")
-team_order    = sorted(F[pec_c].dropna().unique())  if (pec_c and not F.empty)  else []
-vcentre_order = sorted(F[clus_c].dropna().unique()) if (clus_c and not F.empty) else []
+SEX, REF = _derived(F_SIG, sex_col, ref_c, F)
+team_order    = sorted_unique(F[pec_c])  if pec_c  else []
+vcentre_order = sorted_unique(F[clus_c]) if clus_c else []
 
-team_df = mf_table(F, pec_c, "Team", order=team_order) if (pec_c and sex_col in F.columns) else pd.DataFrame(columns=["Team","Male","Female","Total"])
-vc_df   = mf_table(F, clus_c, "Vision Centre", order=vcentre_order) if (clus_c and sex_col in F.columns) else pd.DataFrame(columns=["Vision Centre","Male","Female","Total"])
-ref_df  = mf_table(F, clus_c, "Vision Centre", mask=yes_like(F[ref_c]) if ref_c else None, order=vcentre_order) if (clus_c and sex_col in F.columns and ref_c) else pd.DataFrame(columns=["Vision Centre","Male","Female","Total"])
+team_df = mf_table(F, pec_c, "Team", order=team_order, sex=SEX) if (pec_c and sex_col in F.columns) else pd.DataFrame(columns=["Team","Male","Female","Total"])
+vc_df   = mf_table(F, clus_c, "Vision Centre", order=vcentre_order, sex=SEX) if (clus_c and sex_col in F.columns) else pd.DataFrame(columns=["Vision Centre","Male","Female","Total"])
+ref_df  = mf_table(F, clus_c, "Vision Centre", mask=REF, order=vcentre_order, sex=SEX) if (clus_c and sex_col in F.columns and ref_c) else pd.DataFrame(columns=["Vision Centre","Male","Female","Total"])
 
 team_df_viz = add_row_pct_compact(team_df, "Team")
 vc_df_viz   = add_row_pct_compact(vc_df, "Vision Centre")
 ref_df_viz  = add_row_pct_compact(ref_df, "Vision Centre")
 
-diag_c, refdig_c, clinic_c = col_ok("diagnosis_code"), col_ok("ref_dig"), col_ok("clinic")
-diag_df   = mf_table(F, diag_c, "Diagnosis", order=None) if (diag_c and sex_col in F.columns) else pd.DataFrame(columns=["Diagnosis","Male","Female","Total"])
-refdig_df = mf_table(F, refdig_c, "Referred Diagnosis", order=None) if (refdig_c and sex_col in F.columns) else pd.DataFrame(columns=["Referred Diagnosis","Male","Female","Total"])
-clinic_df = mf_table(F, clinic_c, "Clinic", order=None) if (clinic_c and sex_col in F.columns) else pd.DataFrame(columns=["Clinic","Male","Female","Total"])
+diag_c, refdig_c, clinic_c = COLS["diagnosis_code"], COLS["ref_dig"], COLS["clinic"]
+diag_df   = mf_table(F, diag_c, "Diagnosis", order=None, sex=SEX) if (diag_c and sex_col in F.columns) else pd.DataFrame(columns=["Diagnosis","Male","Female","Total"])
+refdig_df = mf_table(F, refdig_c, "Referred Diagnosis", order=None, sex=SEX) if (refdig_c and sex_col in F.columns) else pd.DataFrame(columns=["Referred Diagnosis","Male","Female","Total"])
+clinic_df = mf_table(F, clinic_c, "Clinic", order=None, sex=SEX) if (clinic_c and sex_col in F.columns) else pd.DataFrame(columns=["Clinic","Male","Female","Total"])
 
 if not diag_df.empty and {"Diagnosis","Total"}.issubset(diag_df.columns):
-    diag_df = (
-        diag_df.assign(_tail=is_tail_label(diag_df["Diagnosis"]))
-               .sort_values(by=["_tail","Total","Diagnosis"], ascending=[True,False,True], kind="mergesort")
-               .drop(columns=["_tail"])
-               .reset_index(drop=True)
-    )
+    # tail labels last, then Total desc, then Diagnosis asc (lexsort: last key is primary)
+    name_rank = pd.factorize(diag_df["Diagnosis"], sort=True)[0]
+    tail = is_tail_label(diag_df["Diagnosis"]).to_numpy()
+    order = np.lexsort((name_rank, -diag_df["Total"].to_numpy(), tail))
+    diag_df = diag_df.take(order).reset_index(drop=True)
 
 refdig_df_clean = clean_label_rows(refdig_df, "Referred Diagnosis")
 clinic_df_clean = clean_label_rows(clinic_df, "Clinic")
@@ -280,4 +305,4 @@ with r2c1:
     st.dataframe(clinic_df_compact, use_container_width=True, height=TABLE_HEIGHT, hide_index=True)
 
 # ========== Footer ==========
-st.markdown("<div class='caption'>✨ Use the <b>Clear</b> button in the sidebar to reset filters.</div>", unsafe_allow_html=True)
+st.html(FOOTER_HTML)
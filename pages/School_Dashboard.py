@@ -1,13 +1,14 @@
 import streamlit as st
+import numpy as np
+import pandas as pd
 from common.Chart_builder import builder
-from common.helper import inject_global_dataframe_css, render_metric_cards
+from common.helper import render_metric_cards, text_isin, section
 from common.render import render_many
 from common import config
-from common.dynamic_sidebar import dynamic_sidebar_filters
+from common.dynamic_sidebar import dynamic_sidebar_filters, filter_signature
 
 # -------------------- Page Setup --------------------
 config.setup_page(page_title="📊 School Program", page_key="school_program")
-inject_global_dataframe_css()
 
 # -------------------- Data Config --------------------
 DATA_PATH, SHEET = config.get_data_path("School_Program.xlsx", sheet=0)
@@ -44,6 +45,9 @@ filter_order = [
     {"col": "sex", "label": "👦👧 Sex", "type": "multiselect"},
 ]
 f, selected_filters = dynamic_sidebar_filters(df, RES, filter_order)
+# f is fully determined by the data file and the filter values; cached derived rows key on this
+F_SIG = (str(DATA_PATH), SHEET, DATA_PATH.stat().st_mtime, filter_signature(filter_order))
+FOOTER_HTML = "<div class='caption'>✨ Use the <b>Clear</b> button in the sidebar to reset filters.</div>"
 
 # -------------------- Header --------------------
 config.render_page_header(
@@ -51,17 +55,15 @@ config.render_page_header(
 )
 
 # -------------------- Metric Card with Subcaption --------------------
-def metric_card_with_subcaption(
+def metric_card_with_subcaption_html(
     title: str,
     value: str,
     subcaption: str,
     icon: str = "🏫",
     color: str = "#2563eb",
-    container=None,
-):
-    """Render metric card visually matching metric_card(), with a subcaption line and blue accent."""
-    target = container if container is not None else st
-    html = f"""
+) -> str:
+    """Metric card HTML visually matching metric_card(), with a subcaption line and blue accent."""
+    return f"""
 <div style="
     border:1px solid rgba(2,6,23,0.08);
     border-radius:14px;
@@ -77,27 +79,31 @@ def metric_card_with_subcaption(
   <div style="margin-top:4px;font-size:.9rem;color:#64748b;">{subcaption}</div>
 </div>
 """
-    target.markdown(html, unsafe_allow_html=True)
 
 
 # -------------------- Key Metrics --------------------
-st.markdown("---")
-st.subheader("📌 Key Metrics")
+section("📌 Key Metrics")
 
-school_col = next((c for c in [RES.get("school_name"), RES.get("schoolcode")] if c in f.columns), None)
+# resolved against df.columns by load_df_or_stop (schoolcode is one of its candidates); filters keep the columns
+school_col = RES.get("school_name")
 stype_col = RES.get("school_type")
-n_schools = f[school_col].dropna().nunique() if school_col else 0
+def _str_codes(s) -> tuple:
+    """Codes of s.astype(str) over non-null rows (-1 for NA) and their labels, sorted like groupby keys."""
+    codes, uniques = pd.factorize(s)
+    lab_codes, labels = pd.factorize(pd.Index([str(u) for u in uniques], dtype=object), sort=True)
+    return np.append(lab_codes, -1)[codes], labels
+
+n_schools = len(pd.factorize(f[school_col])[1]) if school_col else 0  # distinct non-null schools
 
 type_breakdown = "—"
 if school_col and stype_col and stype_col in f.columns:
-    tmp = (
-        f.dropna(subset=[stype_col, school_col])
-         .astype({stype_col: str, school_col: str})
-         .drop_duplicates(subset=[stype_col, school_col])
-         .groupby(stype_col)[school_col]
-         .nunique()
-         .sort_values(ascending=False)
-    )
+    # distinct (type, school) pairs as packed codes, then schools per type with one bincount
+    t_codes, t_labels = _str_codes(f[stype_col])
+    s_codes, s_labels = _str_codes(f[school_col])
+    keep = (t_codes >= 0) & (s_codes >= 0)
+    pairs = np.unique(t_codes[keep] * len(s_labels) + s_codes[keep])
+    per_type = np.bincount(pairs // max(len(s_labels), 1), minlength=len(t_labels))
+    tmp = pd.Series(per_type, index=t_labels)[per_type > 0].sort_values(ascending=False)
     if not tmp.empty:
         type_breakdown = " | ".join([f"{k}: {v}" for k, v in tmp.items()])
 
@@ -108,29 +114,36 @@ metrics = {
     "➡️ Referred":                ("ref_eye_spec", "examined"),
 }
 
-cols = st.columns(1 + len(metrics))
-
-# Schools covered card
-metric_card_with_subcaption(
+# Schools covered card leads the row; all five cards go out in one markdown call
+schools_card = metric_card_with_subcaption_html(
     title="Schools Covered",
     value=f"{n_schools:,}",
     subcaption=type_breakdown,
     icon="🏫",
     color="#2563eb",
-    container=cols[0],
 )
-
-# Other metrics
-render_metric_cards(metrics, df=f, res=RES, columns=cols[1:])
+render_metric_cards(metrics, df=f, res=RES, lead_cards=[schools_card])
 
 # -------------------- Attendance Filter --------------------
 att_col = RES.get("screen_attend")
-mask_present = f[att_col].astype(str).str.strip().str.lower().eq("present") if att_col in f.columns else []
-attended = f.loc[mask_present] if not f.empty else f
+PRESENT = frozenset({"present"})
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _present_rows(sig, att: str, _f: pd.DataFrame) -> np.ndarray:
+    # sig stands in for the (unhashed) frame; positions are cheap to copy out of the cache
+    return np.flatnonzero(text_isin(_f[att], PRESENT).to_numpy())
 
 # -------------------- Demographics --------------------
-st.markdown("---")
-st.subheader("👨‍👩‍👧 Demographics Screening")
+section("👨‍👩‍👧 Demographics Screening")
+
+# Nothing below has anything to show for zero rows: skip the attendance mask and every chart section
+if f.empty:
+    st.info("No data to display with the current filters.")
+    st.html(FOOTER_HTML)
+    st.stop()
+
+attended = f.take(_present_rows(F_SIG, att_col, f)) if att_col in f.columns else f.iloc[:0]
+
 if not attended.empty:
     cols = st.columns(4)
     render_many([
@@ -138,46 +151,40 @@ if not attended.empty:
         dict(container=cols[1], col=RES.get("age1"),             title="Age Distribution",                chart_func=builder.pie, kind="pie"),
         dict(container=cols[2], col=RES.get("wearspec"),         title="Wearing Glasses or Contact Lens", chart_func=builder.pie, kind="pie"),
         dict(container=cols[3], col=RES.get("refer_to_optho"),   title="Referral to Optometrist",         chart_func=builder.pie, kind="pie"),
-    ], f, attended)
+    ], f, attended, cache_key=F_SIG)
 else:
     st.info("No data to display with the current filters.")
 
 # -------------------- Clinical --------------------
-st.markdown("---")
-st.subheader("🧑‍⚕️ Clinical Screening")
+section("🧑‍⚕️ Clinical Screening")
 if not attended.empty:
     c = st.columns(3)
     render_many([
         dict(container=c[0], col=RES.get("refraction_attend"), title="Refraction Attendance", chart_func=builder.pie, kind="pie"),
         dict(container=c[1], col=RES.get("refraction_type"),   title="Refraction Type",       chart_func=builder.bar, kind="bar", bar_with_labels=True),
         dict(container=c[2], col=RES.get("spec_pres"),         title="Spectacle Prescription",chart_func=builder.pie, kind="pie"),
-    ], f, attended)
+    ], f, attended, cache_key=F_SIG)
 else:
     st.info("No data to display with the current filters.")
 
 # -------------------- Myopia --------------------
-st.markdown("---")
-st.subheader("👁️ Myopia & Eye Specialist Referrals")
+section("👁️ Myopia & Eye Specialist Referrals")
 if not attended.empty:
     m_cols = st.columns(3)
     render_many([
         dict(container=m_cols[0], col=RES.get("myopia_p"),      title="Myopia Presence",            chart_func=builder.pie, kind="pie"),
         dict(container=m_cols[1], col=RES.get("myopia_cat_p"),  title="Myopia Category",            chart_func=builder.pie, kind="pie"),
         dict(container=m_cols[2], col=RES.get("ref_eye_spec"),  title="Referred to Eye Specialist", chart_func=builder.pie, kind="pie"),
-    ], f, attended)
+    ], f, attended, cache_key=F_SIG)
 
 # -------------------- Referral --------------------
-st.markdown("---")
-st.subheader("📑 Referral Reasons")
+section("📑 Referral Reasons")
 if not attended.empty:
     b1, = st.columns(1)
     render_many([
         dict(container=b1, col=RES.get("refer_reason"), title="Referral Reasons", chart_func=builder.bar, kind="bar", bar_with_labels=True, drop_values={"", "nan"})
-    ], f, attended)
+    ], f, attended, cache_key=F_SIG)
 
 
 # -------------------- Footer --------------------
-st.markdown(
-    "<div class='caption'>✨ Use the <b>Clear</b> button in the sidebar to reset filters.</div>",
-    unsafe_allow_html=True,
-)
+st.html(FOOTER_HTML)
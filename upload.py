@@ -1,5 +1,9 @@
+import hmac
 import os
+import shutil
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List
 
@@ -7,13 +11,38 @@ from flask import Flask, request, jsonify, abort
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 
+# Optional: orjson for the JSON responses (same bytes as jsonify, C serializer)
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
 # ----- Config -----
 load_dotenv()
 
 UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", "./data")).resolve()
 UPLOAD_TOKEN = os.getenv("UPLOAD_TOKEN", "").strip()
 MAX_CONTENT_LENGTH_MB = float(os.getenv("MAX_CONTENT_LENGTH_MB", "50"))  # per request
-ALLOWED_EXTENSIONS = {".xls", ".xlsx", ".xlsm", ".xlsb"}  # Excel types
+ALLOWED_EXTENSIONS = frozenset({".xls", ".xlsx", ".xlsm", ".xlsb"})  # Excel types
+COPY_CHUNK = 1 << 20  # 1 MiB writes instead of FileStorage.save's 16 KiB
+USE_SENDFILE = sys.platform.startswith("linux") and hasattr(os, "sendfile")
+
+# Opt-in (WARM_CACHE=1): pre-build the dashboards' Parquet cache for each uploaded workbook,
+# so the first dashboard visit after an upload skips the Excel parse. Only useful when
+# UPLOAD_DIR is the dashboards' data dir; common.config also pulls in streamlit/pandas/pyarrow.
+WARM_CACHE = os.getenv("WARM_CACHE", "0").strip().lower() in {"1", "true", "yes"}
+HAS_DASHBOARD_CACHE = False
+if WARM_CACHE:
+    try:
+        from common.config import DATA_DIR as DASHBOARD_DATA_DIR, warm_parquet_cache
+        HAS_DASHBOARD_CACHE = True
+    except Exception as e:  # missing deps or a failing dashboard import must not stop the upload server
+        print(f"[warm-cache] disabled: {e}", file=sys.stderr)
+    else:
+        if UPLOAD_DIR != DASHBOARD_DATA_DIR:
+            print(f"[warm-cache] disabled: UPLOAD_DIR is not the dashboards' data dir ({DASHBOARD_DATA_DIR})", file=sys.stderr)
+    WARM_CACHE = HAS_DASHBOARD_CACHE and UPLOAD_DIR == DASHBOARD_DATA_DIR
 
 app = Flask(__name__)
 app.config["MAX_CONTENT_LENGTH"] = int(MAX_CONTENT_LENGTH_MB * 1024 * 1024)
@@ -22,10 +51,22 @@ app.config["MAX_CONTENT_LENGTH"] = int(MAX_CONTENT_LENGTH_MB * 1024 * 1024)
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
 def is_valid_token(token: str) -> bool:
-    return len(token) == 32 and token == UPLOAD_TOKEN
+    # constant-time compare; bytes, since compare_digest rejects non-ASCII str
+    return len(token) == 32 and hmac.compare_digest(token.encode(), UPLOAD_TOKEN.encode())
 
 def allowed_ext(filename: str) -> bool:
-    return Path(filename).suffix.lower() in ALLOWED_EXTENSIONS
+    # Path(filename).suffix without building a Path; a dotfile like ".xlsx" has no suffix
+    dot = filename.rfind(".")
+    return dot > 0 and filename[dot:].lower() in ALLOWED_EXTENSIONS
+
+# one background worker: conversions run after the response, one workbook at a time
+_warm_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="warm-cache") if WARM_CACHE else None
+
+def _warm(dest: Path) -> None:
+    try:
+        warm_parquet_cache(dest, sheet=0)
+    except Exception as e:  # best-effort: the dashboard falls back to reading the workbook
+        print(f"[warm-cache] {dest.name}: {e}", file=sys.stderr)
 
 def uniquify(dest_dir: Path, filename: str) -> Path:
     """
@@ -39,9 +80,69 @@ def uniquify(dest_dir: Path, filename: str) -> Path:
     ts = int(time.time() * 1000)
     return dest_dir / f"{stem}-{ts}{suffix}"
 
+def _copy_upload(stream, out) -> None:
+    """
+    Copy an uploaded part into out. Parts werkzeug spooled to a real temp file are copied
+    kernel-side with os.sendfile; in-memory parts (and any sendfile failure) use copyfileobj.
+    """
+    # SpooledTemporaryFile.fileno() would force an in-memory part to disk; ask its backing file
+    raw = getattr(stream, "_file", stream)
+    in_fd = None
+    if USE_SENDFILE:
+        try:
+            in_fd = raw.fileno()
+        except (AttributeError, OSError, ValueError):  # BytesIO raises io.UnsupportedOperation (an OSError)
+            in_fd = None
+    if in_fd is not None:
+        start = offset = raw.tell()
+        end = os.fstat(in_fd).st_size
+        try:
+            while offset < end:
+                sent = os.sendfile(out.fileno(), in_fd, offset, end - offset)
+                if not sent:
+                    break
+                offset += sent
+            raw.seek(offset)
+            return
+        except OSError:
+            out.seek(0)
+            out.truncate()
+            raw.seek(start)
+    shutil.copyfileobj(stream, out, COPY_CHUNK)
+
+def save_one(f, dest: Path):
+    """
+    Save one uploaded file to dest via a temp file; returns ("saved", path) or ("skipped", info).
+    """
+    tmp_dest = dest.with_suffix(dest.suffix + ".uploading")
+    try:
+        # save to a temp file first
+        with open(tmp_dest, "wb") as out:
+            _copy_upload(f.stream, out)
+        # atomically replace any existing file
+        os.replace(tmp_dest, dest)  # works on Windows & *nix
+        if _warm_pool is not None:
+            _warm_pool.submit(_warm, dest)
+        return "saved", str(dest)
+    except Exception as e:
+        # cleanup temp if present
+        try:
+            if tmp_dest.exists():
+                tmp_dest.unlink(missing_ok=True)  # Python 3.8+: wrap in try if missing_ok not available
+        except Exception:
+            pass
+        return "skipped", {"filename": f.filename or "", "reason": f"save/replace failed: {e}"}
+
+def json_response(code: int, **fields):
+    """jsonify(**fields), code; serialized with orjson when available (sorted keys, trailing newline, like jsonify)."""
+    if not HAS_ORJSON:
+        return jsonify(**fields), code
+    body = orjson.dumps(fields, default=str, option=orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE)
+    return app.response_class(body, status=code, mimetype="application/json")
+
 @app.errorhandler(413)
 def too_large(_e):
-    return jsonify(error="Request entity too large"), 413
+    return json_response(413, error="Request entity too large")
 
 @app.post("/upload/<token>")
 def upload_files(token: str):
@@ -57,40 +158,40 @@ def upload_files(token: str):
     if not files:
         abort(400, description="No files provided")
 
-    saved, skipped = [], []
-    for f in files:
+    # request.files is fully parsed (each part spooled to its own buffer) before we
+    # get here, so the per-file copies below never share a stream.
+    results: List = [None] * len(files)
+    groups = {}  # dest -> indices; same-name files stay in one task, in upload order
+    for i, f in enumerate(files):
         filename = f.filename or ""
         if not filename:
-            skipped.append({"filename": filename, "reason": "empty filename"})
-            continue
-        if not allowed_ext(filename):
-            skipped.append({"filename": filename, "reason": "extension not allowed"})
-            continue
-
-        # Build destination path (no uniquify — we overwrite)
-        safe_name = secure_filename(filename)
-        dest = (UPLOAD_DIR / safe_name)
-        tmp_dest = dest.with_suffix(dest.suffix + ".uploading")
-
-        try:
-            # save to a temp file first
-            f.save(tmp_dest)
-            # atomically replace any existing file
-            os.replace(tmp_dest, dest)  # works on Windows & *nix
-            saved.append(str(dest))
-        except Exception as e:
-            # cleanup temp if present
-            try:
-                if tmp_dest.exists():
-                    tmp_dest.unlink(missing_ok=True)  # Python 3.8+: wrap in try if missing_ok not available
-            except Exception:
-                pass
-            skipped.append({"filename": filename, "reason": f"save/replace failed: {e}"})
+            results[i] = ("skipped", {"filename": filename, "reason": "empty filename"})
+        elif not allowed_ext(filename):
+            results[i] = ("skipped", {"filename": filename, "reason": "extension not allowed"})
+        else:
+            # Build destination path (no uniquify — we overwrite)
+            groups.setdefault(UPLOAD_DIR / secure_filename(filename), []).append(i)
+
+    def save_group(item):
+        dest, idxs = item
+        for i in idxs:
+            results[i] = save_one(files[i], dest)
+
+    if len(groups) > 1:
+        # disk writes overlap across files; the GIL is released during write()
+        with ThreadPoolExecutor(max_workers=min(8, len(groups))) as ex:
+            list(ex.map(save_group, groups.items()))
+    else:
+        for item in groups.items():
+            save_group(item)
+
+    saved = [r for kind, r in results if kind == "saved"]
+    skipped = [r for kind, r in results if kind == "skipped"]
 
     if not saved and skipped:
-        return jsonify(status="error", saved=saved, skipped=skipped), 400
+        return json_response(400, status="error", saved=saved, skipped=skipped)
 
-    return jsonify(status="ok", saved=saved, skipped=skipped), 201
+    return json_response(201, status="ok", saved=saved, skipped=skipped)
 
 
 if __name__ == "__main__":